@@ -3,9 +3,27 @@
 Tarifierungstool Backend – Sichere Groq-API-Proxy + Klassifizierungslogik.
 Deployed auf Render.com als Web Service.
 """
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
-import json, os, re, urllib.request, urllib.error, urllib.parse
+import hashlib, json, os, queue, re, threading, time, urllib.parse
+from collections import namedtuple
+from corpus import BundleWatcher, CorpusStore, open_corpus
+from keyword_matcher import KeywordMatcher
+from cache import LookupCache, ResultCache, normalize_query
+from parallel import make_pool, delayed, first_by_priority
+from concurrent.futures import FIRST_COMPLETED, wait
+from http_client import HTTPClient, HTTPError
+from prompt_packer import pack_context, estimate_tokens
+from rate_limiter import BATCH, PRIORITY, RateLimiter, retry_call
+import deadline as request_deadline
+from deadline import Deadline, DeadlineExceeded, stage_deadline, stage_timeout
+from singleflight import SingleFlight, CrossWorkerFlight
+from metrics import Registry, TOKEN_BUCKETS, collect_timings, span
+from off_snapshot import OFFSnapshot
+from chapter_model import ChapterModel
+from similarity import SimilarityIndex
+from tariff_index import TariffIndex, normalize_number
+from retrieval import tokenize
 
 app = Flask(__name__)
 CORS(app)  # Frontend darf von überall zugreifen
@@ -13,11 +31,73 @@ CORS(app)  # Frontend darf von überall zugreifen
 # ── API Key (aus Render Environment Variable) ──
 GROQ_API_KEY = os.environ.get("GROQ_API_KEY", "")
 GROQ_MODEL = "llama-3.3-70b-versatile"
-GROQ_URL = "https://api.groq.com/openai/v1/chat/completions"
+GROQ_URL = os.environ.get("GROQ_URL", "https://api.groq.com/openai/v1/chat/completions")
+OFF_BASE_URL = os.environ.get("OFF_BASE_URL", "https://world.openfoodfacts.org")
+
+# ── Groq rate limits (Werte aus dem Groq-Konto; Header-Feedback passt sie laufend an) ──
+# Das Konto-Limit gilt für alle Worker zusammen: jeder bekommt seinen Anteil
+GROQ_WORKERS = max(1, int(os.environ.get("WEB_CONCURRENCY", "1")))
+GROQ_LIMITER = RateLimiter(
+    requests_per_minute=int(os.environ.get("GROQ_RPM", "1000")) / GROQ_WORKERS,
+    tokens_per_minute=int(os.environ.get("GROQ_TPM", "300000")) / GROQ_WORKERS)
+GROQ_DEADLINE = float(os.environ.get("GROQ_DEADLINE", "40"))      # Sekunden pro Aufruf inkl. Retries
+GROQ_MAX_ATTEMPTS = int(os.environ.get("GROQ_MAX_ATTEMPTS", "4"))
+
+# ── Metriken (GET /metrics; mit METRICS_DIR über alle gunicorn-Worker summiert) ──
+METRICS = Registry(os.environ.get("METRICS_DIR") or None,
+                   flush_interval=float(os.environ.get("METRICS_FLUSH_INTERVAL", "5")))
+STAGE_SECONDS = METRICS.histogram(
+    "tarif_stage_duration_seconds", "Dauer pro Pipeline-Stufe in Sekunden", ("stage",))
+UPSTREAM_REQUESTS = METRICS.counter(
+    "tarif_upstream_requests_total", "Ausgehende HTTP-Requests nach Upstream und Status", ("upstream", "status"))
+UPSTREAM_SECONDS = METRICS.histogram(
+    "tarif_upstream_duration_seconds", "Dauer ausgehender HTTP-Requests in Sekunden", ("upstream",))
+CACHE_LOOKUPS = METRICS.counter(
+    "tarif_cache_lookups_total", "Cache-Zugriffe nach Cache und Ergebnis", ("cache", "result"))
+DATA_SOURCE = METRICS.counter(
+    "tarif_data_source_total", "Herkunft der Produktdaten (off, web, none)", ("source",))
+PROMPT_TOKENS = METRICS.histogram(
+    "tarif_prompt_tokens", "Geschätzte Tokens des Klassifizierungs-Prompts", (), TOKEN_BUCKETS)
+LLM_TOKENS = METRICS.counter(
+    "tarif_llm_tokens_total", "Von Groq gemeldete Tokens nach Modell und Art", ("model", "kind"))
+CLASSIFICATIONS = METRICS.counter(
+    "tarif_classifications_total", "Klassifizierungen nach Ausgang", ("outcome",))
+TARIFF_CHECKS = METRICS.counter(
+    "tarif_tariff_checks_total", "Prüfung der Tarifnummer gegen die BAZG-Texte nach Ergebnis", ("status",))
+METRICS.start()
+
+
+def observe_upstream(host, status, seconds):
+    UPSTREAM_REQUESTS.inc(upstream=host, status=status)
+    UPSTREAM_SECONDS.observe(seconds, upstream=host)
+
+
+def record_llm_usage(model, usage):
+    for kind in ("prompt_tokens", "completion_tokens"):
+        if (usage or {}).get(kind):
+            LLM_TOKENS.inc(usage[kind], model=model, kind=kind.split("_")[0])
+
+
+def stage(name):
+    return span(name, STAGE_SECONDS)
+
+
+# ── HTTP transport (Keep-Alive-Pool pro Host, gemeinsam für Groq und OFF) ──
+HTTP = HTTPClient(
+    user_agent="Tarifierungstool/4.0",
+    connect_timeout=float(os.environ.get("HTTP_CONNECT_TIMEOUT", "5")),
+    read_timeout=float(os.environ.get("HTTP_READ_TIMEOUT", "25")),
+    max_idle_per_host=int(os.environ.get("HTTP_POOL_SIZE", "8")),
+    observer=observe_upstream)
 
 # ── BAZG Cache Pfad ──
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 CACHE_DIR = os.path.join(BASE_DIR, 'bazg_cache')
+# Vorkompiliertes Bundle (python corpus.py), per mmap von allen Workern geteilt; ohne Bundle die Textdateien
+CORPUS_BUNDLE_PATH = os.environ.get("CORPUS_BUNDLE_PATH", os.path.join(BASE_DIR, "bazg_corpus.bundle"))
+CORPUS_WATCHER = BundleWatcher(CORPUS_BUNDLE_PATH, float(os.environ.get("CORPUS_RELOAD_INTERVAL", "10")),
+                               lambda path: swap_corpus(path))
+CORPUS = open_corpus(CACHE_DIR, CORPUS_BUNDLE_PATH)  # einmal pro Worker beim Start
 
 # ── AV text ──
 AV_TEXT = """ALLGEMEINE VORSCHRIFTEN (AV):
@@ -44,29 +124,122 @@ ZOLLANSÄTZE:
 - Kap. 25-97 (Industrie): seit 1.1.2024 weitgehend zollfrei (0 CHF)"""
 
 
-def call_groq(messages, max_tokens=3000, temperature=0.1):
+def call_groq(messages, max_tokens=3000, temperature=0.1, deadline=None):
     """Groq API call."""
-    payload = json.dumps({
+    payload = {
         "model": GROQ_MODEL,
         "messages": messages,
         "max_tokens": max_tokens,
         "temperature": temperature,
         "response_format": {"type": "json_object"}
-    }).encode("utf-8")
+    }
 
-    req = urllib.request.Request(GROQ_URL, data=payload, headers={
-        "Authorization": f"Bearer {GROQ_API_KEY}",
-        "Content-Type": "application/json",
-        "User-Agent": "Tarifierungstool/4.0"
-    })
+    data = groq_post(payload, timeout=25, deadline=deadline)
+    content = data["choices"][0]["message"]["content"]
+    return json.loads(content)
 
-    with urllib.request.urlopen(req, timeout=25) as resp:
-        data = json.loads(resp.read().decode("utf-8"))
-        content = data["choices"][0]["message"]["content"]
-        return json.loads(content)
+
+def call_groq_stream(messages, on_token, max_tokens=3000, temperature=0.1, deadline=None):
+    """Groq API call with streamed completion: on_token(text) per delta, returns the parsed JSON."""
+    payload = {
+        "model": GROQ_MODEL,
+        "messages": messages,
+        "max_tokens": max_tokens,
+        "temperature": temperature,
+        "response_format": {"type": "json_object"},
+        "stream": True
+    }
+
+    reserved = estimate_request_tokens(payload)
+    deadline = deadline or stage_deadline(GROQ_DEADLINE)
+
+    def open_stream(remaining):
+        GROQ_LIMITER.acquire(reserved, deadline=deadline)
+        try:
+            resp = HTTP.stream("POST", GROQ_URL, body=json.dumps(payload).encode("utf-8"),
+                               timeout=min(25, remaining), headers={
+                                   "Authorization": f"Bearer {GROQ_API_KEY}",
+                                   "Content-Type": "application/json",
+                                   "Accept": "text/event-stream"
+                               })
+        except HTTPError as e:
+            GROQ_LIMITER.observe(e.headers, e.status)
+            raise
+        GROQ_LIMITER.observe(resp.headers, resp.status)
+        return resp
+
+    resp = retry_call(open_stream, deadline, max_attempts=GROQ_MAX_ATTEMPTS)  # Retries nur bis zum ersten Byte
+
+    parts = []
+    usage = None
+    lines = resp.lines()
+    try:
+        for line in lines:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise DeadlineExceeded("LLM-Stream durch Zeitbudget abgebrochen")
+            resp.settimeout(min(25, remaining))  # der nächste Read endet spätestens an der Deadline
+            if not line.startswith(b"data:"):
+                continue
+            data = line[5:].strip()
+            if data == b"[DONE]":
+                break
+            chunk = json.loads(data.decode("utf-8"))
+            usage = (chunk.get("x_groq") or {}).get("usage") or chunk.get("usage") or usage
+            choices = chunk.get("choices") or [{}]
+            text = (choices[0].get("delta") or {}).get("content")
+            if text:
+                parts.append(text)
+                on_token(text)
+    except BaseException:
+        lines.close()  # Stream abbrechen – die Verbindung wird geschlossen, nicht wiederverwendet
+        raise
+    for _ in lines:
+        pass  # Rest lesen, damit die Verbindung in den Pool zurück kann
+    GROQ_LIMITER.settle(reserved, (usage or {}).get("total_tokens"))
+    record_llm_usage(payload["model"], usage)
+    return json.loads("".join(parts))
+
+
+def groq_post(payload, timeout, deadline=None):
+    """POST a chat completion to Groq: rate-limited, retried with backoff until the deadline."""
+    reserved = estimate_request_tokens(payload)
+    deadline = deadline or stage_deadline(GROQ_DEADLINE)
+
+    def attempt(remaining):
+        GROQ_LIMITER.acquire(reserved, deadline=deadline)
+        try:
+            resp = HTTP.post_json(GROQ_URL, payload, headers={"Authorization": f"Bearer {GROQ_API_KEY}"},
+                                  timeout=min(timeout, remaining))
+        except HTTPError as e:
+            GROQ_LIMITER.observe(e.headers, e.status)
+            raise
+        GROQ_LIMITER.observe(resp.headers, resp.status)
+        return resp.json()
+
+    data = retry_call(attempt, deadline, max_attempts=GROQ_MAX_ATTEMPTS)
+    GROQ_LIMITER.settle(reserved, (data.get("usage") or {}).get("total_tokens"))
+    record_llm_usage(payload["model"], data.get("usage"))
+    return data
+
+
+def estimate_request_tokens(payload):
+    """Tokens a request will count against the TPM limit: prompt estimate plus max_tokens."""
+    prompt = "".join(m.get("content", "") for m in payload.get("messages", []))
+    return estimate_tokens(prompt) + payload.get("max_tokens", 0)
 
 
 # ── Open Food Facts lookup ──
+# Positiv-/Negativ-Cache für OFF: Treffer 24 h, "nicht gefunden" 1 h, Fehler/Timeouts 60 s
+OFF_CACHE = LookupCache(
+    maxsize=int(os.environ.get("OFF_CACHE_SIZE", "5000")),
+    ttl=int(os.environ.get("OFF_CACHE_TTL", "86400")),
+    negative_ttl=int(os.environ.get("OFF_NEGATIVE_TTL", "3600")),
+    error_ttl=int(os.environ.get("OFF_ERROR_TTL", "60")),
+    transient=(DeadlineExceeded,),
+    on_count=lambda name: CACHE_LOOKUPS.inc(cache="off", result=name))
+
+
 def search_openfoodfacts(query):
     clean = re.sub(r'\D', '', query)
     if len(clean) >= 8:
@@ -76,55 +249,102 @@ def search_openfoodfacts(query):
     return off_text_search(query)
 
 
+def off_get_json(url, timeout):
+    """GET from OFF with the stage timeout capped by the request deadline."""
+    capped = stage_timeout(timeout)
+    try:
+        return HTTP.get_json(url, timeout=capped)
+    except TimeoutError:
+        if capped < timeout:
+            raise DeadlineExceeded("OFF-Lookup durch Zeitbudget abgebrochen") from None
+        raise
+
+
+# Lokaler OFF-Snapshot (python off_snapshot.py <dump>) – wird vor dem Netzwerk gefragt
+OFF_SNAPSHOT = OFFSnapshot.open(os.environ.get("OFF_SNAPSHOT_PATH", os.path.join(BASE_DIR, "off_snapshot.sqlite3")))
+
+
 def off_by_barcode(ean):
+    if OFF_SNAPSHOT:
+        product = OFF_SNAPSHOT.product(ean)
+        CACHE_LOOKUPS.inc(cache="off_snapshot", result="hit" if product else "miss")
+        if product:
+            return format_off_product(product, ean)
+    with stage("off_barcode"):
+        return OFF_CACHE.lookup(f"ean:{ean}", lambda: _off_fetch_barcode(ean))
+
+
+def _off_fetch_barcode(ean):
+    url = f"{OFF_BASE_URL}/api/v2/product/{ean}.json?fields=product_name,brands,ingredients_text,categories,quantity"
     try:
-        url = f"https://world.openfoodfacts.org/api/v2/product/{ean}.json?fields=product_name,brands,ingredients_text,categories,quantity"
-        req = urllib.request.Request(url, headers={"User-Agent": "Tarifierungstool/4.0"})
-        with urllib.request.urlopen(req, timeout=5) as resp:
-            data = json.loads(resp.read().decode("utf-8"))
-            if data.get("status") == 1 and data.get("product"):
-                return format_off_product(data["product"], ean)
-    except Exception:
-        pass
+        data = off_get_json(url, 5)
+    except HTTPError as e:
+        if e.status == 404:
+            return None  # unbekannte EAN – kein Fehler, sondern "nicht gefunden"
+        raise
+    if data.get("status") == 1 and data.get("product"):
+        return format_off_product(data["product"], ean)
     return None
 
 
 def off_text_search(query):
-    result = _off_search(query)
-    if result:
-        return result
-    clean = re.sub(r'[\d,]+\s*(ml|l|g|kg|cl|dl)\b', '', query, flags=re.IGNORECASE).strip()
-    if clean != query:
-        result = _off_search(clean)
+    for variant in off_query_variants(query):
+        result = _off_search(variant)
         if result:
             return result
+    return None
+
+
+# Packungsgrössen ("500 ml", "1,5 l", "1.5l", "380g") – für die Suche und den Ähnlichkeitsvergleich egal
+UNIT_RE = re.compile(r'\d[\d.,]*\s*(ml|l|g|kg|cl|dl)\b', re.IGNORECASE)
+
+
+def off_query_variants(query):
+    """Search terms tried for a text query, in priority order, without duplicates."""
+    variants = [query]
+    clean = UNIT_RE.sub('', query).strip()
+    if clean != query:
+        variants.append(clean)
     words = query.lower().split()
     if len(words) >= 2:
         for i in range(len(words) - 1, 0, -1):
             product_part = ' '.join(words[i:])
             brand_part = ' '.join(words[:i])
             if len(product_part) > 3:
-                result = _off_search(f"{brand_part} {product_part}")
-                if result:
-                    return result
-    return None
+                variants.append(f"{brand_part} {product_part}")
+    unique, seen = [], set()
+    for variant in variants:
+        key = normalize_query(variant)
+        if key and key not in seen:
+            seen.add(key)
+            unique.append(variant)
+    return unique
 
 
 def _off_search(query):
-    try:
-        encoded = urllib.parse.quote(query)
-        url = f"https://world.openfoodfacts.org/cgi/search.pl?search_terms={encoded}&search_simple=1&action=process&json=1&page_size=3&fields=product_name,brands,ingredients_text,categories,quantity,code"
-        req = urllib.request.Request(url, headers={"User-Agent": "Tarifierungstool/4.0"})
-        with urllib.request.urlopen(req, timeout=4) as resp:
-            data = json.loads(resp.read().decode("utf-8"))
-            products = data.get("products", [])
-            for p in products:
-                if p.get("ingredients_text"):
-                    return format_off_product(p, p.get("code", ""))
-            if products:
-                return format_off_product(products[0], products[0].get("code", ""))
-    except Exception:
-        pass
+    if OFF_SNAPSHOT:
+        products = OFF_SNAPSHOT.search(query)
+        CACHE_LOOKUPS.inc(cache="off_snapshot", result="hit" if products else "miss")
+        if products:
+            return pick_off_product(products)
+    with stage("off_search"):
+        return OFF_CACHE.lookup(f"search:{normalize_query(query)}", lambda: _off_fetch_search(query))
+
+
+def _off_fetch_search(query):
+    encoded = urllib.parse.quote(query)
+    url = f"{OFF_BASE_URL}/cgi/search.pl?search_terms={encoded}&search_simple=1&action=process&json=1&page_size=3&fields=product_name,brands,ingredients_text,categories,quantity,code"
+    data = off_get_json(url, 4)
+    return pick_off_product(data.get("products", []))
+
+
+def pick_off_product(products):
+    """First product with ingredients, else the first one at all."""
+    for p in products:
+        if p.get("ingredients_text"):
+            return format_off_product(p, p.get("code", ""))
+    if products:
+        return format_off_product(products[0], products[0].get("code", ""))
     return None
 
 
@@ -153,7 +373,12 @@ def format_off_product(product, ean=""):
 
 
 # ── Web Search Fallback (Groq Compound) ──
-def web_search_product(query):
+def web_search_product(query, deadline=None):
+    with stage("web_search"):
+        return _web_search_product(query, deadline)
+
+
+def _web_search_product(query, deadline):
     try:
         search_prompt = (
             f"Suche im Internet nach dem Produkt: '{query}'.\n"
@@ -167,7 +392,7 @@ def web_search_product(query):
             f'{{"name": "...", "brand": "...", "ingredients": "...", "categories": "...", '
             f'"quantity": "...", "description": "...", "search_url": "..."}}'
         )
-        payload = json.dumps({
+        payload = {
             "model": "groq/compound",
             "messages": [
                 {"role": "system", "content": "Du bist ein Produktrecherche-Assistent. Suche im Web nach dem angegebenen Produkt und extrahiere zollrelevante Daten. Antworte ausschliesslich als JSON."},
@@ -175,88 +400,68 @@ def web_search_product(query):
             ],
             "max_tokens": 1000,
             "temperature": 0.1
-        }).encode("utf-8")
-
-        req = urllib.request.Request(GROQ_URL, data=payload, headers={
-            "Authorization": f"Bearer {GROQ_API_KEY}",
-            "Content-Type": "application/json",
-            "User-Agent": "Tarifierungstool/4.0"
-        })
-
-        with urllib.request.urlopen(req, timeout=15) as resp:
-            data = json.loads(resp.read().decode("utf-8"))
-            content = data["choices"][0]["message"]["content"]
-            json_match = re.search(r'\{[^{}]*(?:\{[^{}]*\}[^{}]*)*\}', content, re.DOTALL)
-            if json_match:
-                result = json.loads(json_match.group())
-            else:
-                result = json.loads(content)
-            name = result.get("name", "").strip()
-            ingredients = result.get("ingredients", "").strip()
-            if name or ingredients:
-                return {
-                    "name": name or query,
-                    "brand": result.get("brand", "").strip(),
-                    "ingredients": ingredients,
-                    "categories": result.get("categories", "").strip(),
-                    "quantity": result.get("quantity", "").strip(),
-                    "description": result.get("description", "").strip(),
-                    "ean": "",
-                    "source": "Web-Suche",
-                    "search_url": result.get("search_url", "")
-                }
+        }
+
+        until = stage_deadline(15)
+        data = groq_post(payload, timeout=15, deadline=min(until, deadline) if deadline else until)
+        content = data["choices"][0]["message"]["content"]
+        json_match = re.search(r'\{[^{}]*(?:\{[^{}]*\}[^{}]*)*\}', content, re.DOTALL)
+        if json_match:
+            result = json.loads(json_match.group())
+        else:
+            result = json.loads(content)
+        name = result.get("name", "").strip()
+        ingredients = result.get("ingredients", "").strip()
+        if name or ingredients:
+            return {
+                "name": name or query,
+                "brand": result.get("brand", "").strip(),
+                "ingredients": ingredients,
+                "categories": result.get("categories", "").strip(),
+                "quantity": result.get("quantity", "").strip(),
+                "description": result.get("description", "").strip(),
+                "ean": "",
+                "source": "Web-Suche",
+                "search_url": result.get("search_url", "")
+            }
     except Exception:
         pass
     return None
 
 
-# ── BAZG document reading (from local cache) ──
-def get_chapter_docs(chapter_num):
-    ch = str(chapter_num).zfill(2)
-    texts = {}
-    erl_file = os.path.join(CACHE_DIR, f"erl_{ch}.txt")
-    if os.path.exists(erl_file):
-        with open(erl_file, 'r') as f:
-            texts["erlaeuterungen"] = f.read()
-    anm_file = os.path.join(CACHE_DIR, f"anm_{ch}.txt")
-    if os.path.exists(anm_file):
-        with open(anm_file, 'r') as f:
-            texts["anmerkungen"] = f.read()
-    return texts
-
-
-def extract_relevant_sections(full_text, product_keywords):
-    lines = full_text.split('\n')
-    sections = []
-    current_section = []
-    current_header = ''
-    for line in lines:
-        is_header = bool(re.match(r'^\s*(\d{4})', line)) or (len(line.strip()) > 5 and line.strip().isupper())
-        if is_header and current_section:
-            sections.append((current_header, '\n'.join(current_section)))
-            current_section = [line]
-            current_header = line.strip()
-        else:
-            current_section.append(line)
-    if current_section:
-        sections.append((current_header, '\n'.join(current_section)))
-
-    result_parts = []
-    if sections:
-        result_parts.append(sections[0][1][:4000])
+# ── Concurrent product-data acquisition ──
+ACQUIRE_POOL = make_pool(int(os.environ.get("ACQUIRE_POOL_SIZE", "32")), "acquire")
+ACQUIRE_TIMEOUT = float(os.environ.get("ACQUIRE_TIMEOUT", "15"))
+# Web-Suche kostet Groq-Tokens: Start erst nach kurzem Vorsprung für OFF (0 = sofort)
+WEB_SEARCH_DELAY = float(os.environ.get("WEB_SEARCH_DELAY", "1.0"))
 
-    priority_terms = {'mindestgehalt', 'quotient', 'fruchtsaft', 'fruchtmark', 'gemüsesaft',
-                      'anmerkung', 'ausgenommen', 'einschliesslich'}
-    keywords_lower = {k.lower() for k in product_keywords if len(k) > 3}
 
-    for header, text in sections[1:]:
-        text_lower = text.lower()
-        relevance = sum(1 for term in keywords_lower if term in text_lower)
-        has_priority = any(p in text_lower for p in priority_terms)
-        if relevance >= 1 or has_priority:
-            result_parts.append(text)
+def acquire_product_data(query, timeout=None, web_search=True):
+    """Barcode lookup, OFF text variants and web search in parallel; OFF beats web.
 
-    return '\n\n'.join(result_parts)
+    Returns (product_info, data_source) with data_source "off", "web" or "none".
+    """
+    tasks = []
+    clean = re.sub(r'\D', '', query)
+    if len(clean) >= 8:
+        tasks.append(lambda: off_by_barcode(clean))
+    tasks.extend((lambda v=variant: _off_search(v)) for variant in off_query_variants(query))
+    off_count = len(tasks)
+    cancelled = threading.Event()
+    timeout = ACQUIRE_TIMEOUT if timeout is None else min(timeout, ACQUIRE_TIMEOUT)
+    if web_search:
+        until = time.monotonic() + timeout   # Web-Suche läuft nicht über das Lookup-Budget hinaus
+        tasks.append(delayed(lambda: web_search_product(query, deadline=until), WEB_SEARCH_DELAY, cancelled))
+
+    index, product_info = first_by_priority(ACQUIRE_POOL, tasks, timeout=timeout, cancelled=cancelled)
+    if product_info is None:
+        return None, "none"
+    return product_info, ("off" if index < off_count else "web")
+
+
+# ── BAZG document reading (preloaded corpus) ──
+def get_chapter_docs(chapter_num):
+    return CORPUS.docs(chapter_num)
 
 
 # ── Classification prompt ──
@@ -390,73 +595,450 @@ CHAPTER_KEYWORDS = {
 }
 
 
-def guess_chapter(query, product_data=None):
+CHAPTER_MATCHER = KeywordMatcher(CHAPTER_KEYWORDS)
+CHAPTER_ANSWER_RE = re.compile(r'\s*(?:kap(?:itel|\.)?\s*)?(\d{1,2})\s*', re.IGNORECASE)
+
+
+def parse_chapter(value):
+    """Chapter 1–97 from an LLM answer (22, 22.0, "22", "Kapitel 22"), else None."""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, int):
+        chapter = value
+    elif isinstance(value, float):
+        chapter = int(value) if value.is_integer() else None
+    else:
+        m = CHAPTER_ANSWER_RE.fullmatch(str(value or ''))
+        chapter = int(m.group(1)) if m else None
+    return chapter if chapter is not None and 1 <= chapter <= 97 else None
+
+
+def chapter_text(query, product_data=None):
     text = query.lower()
     if product_data:
         text += ' ' + (product_data.get('categories', '') + ' ' +
                        product_data.get('name', '')).lower()
-    scores = {}
-    for ch, keywords in CHAPTER_KEYWORDS.items():
-        score = sum(1 for kw in keywords if kw in text)
-        if score > 0:
-            scores[ch] = score
-    if scores:
-        max_score = max(scores.values())
-        top_chapters = [ch for ch, sc in scores.items() if sc == max_score]
-        if len(top_chapters) == 1:
-            return top_chapters[0]
-        return max(top_chapters)
-    return None
+    return text
+
+
+def explain_chapter(query, product_data=None):
+    """Keyword scores per chapter, the hits behind them and whether the top score is tied."""
+    return CHAPTER_MATCHER.match(chapter_text(query, product_data))
+
+
+def keyword_chapter(match, chapter_model, text):
+    """The keyword table's chapter; a tie goes to the tied chapter the chapter model scores highest."""
+    if not match["best"]:
+        return None
+    scores = chapter_model.scores(text) if match["tie"] else {}
+    # ohne Modell-Evidenz bewusst das höchste Kapitel – deterministisch wie bisher
+    return max(match["best"], key=lambda chapter: (scores.get(chapter, 0.0), chapter))
+
+
+def guess_chapter(query, product_data=None):
+    match = explain_chapter(query, product_data)
+    return keyword_chapter(match, CHAPTER_MODEL, chapter_text(query, product_data))
+
+
+# ── Result cache (Speicher + SQLite, überlebt Worker-Neustarts) ──
+RESULT_CACHE = ResultCache(
+    os.environ.get("RESULT_CACHE_PATH", os.path.join(BASE_DIR, "result_cache.sqlite3")),
+    maxsize=int(os.environ.get("RESULT_CACHE_SIZE", "1000")),
+    ttl=int(os.environ.get("RESULT_CACHE_TTL", "86400")))
+# Token-Budget für den Klassifizierungs-Prompt (AV + Anmerkungen + Erläuterungen + Produktdaten)
+PROMPT_TOKEN_BUDGET = int(os.environ.get("PROMPT_TOKEN_BUDGET", "12000"))
+MIN_TOKEN_BUDGET, MAX_TOKEN_BUDGET = 3000, 32000
+PROMPT_VERSION = hashlib.sha256(
+    (GROQ_MODEL + AV_TEXT + CLASSIFY_PROMPT + str(PROMPT_TOKEN_BUDGET)).encode("utf-8")).hexdigest()[:12]
+
+
+# ── Lokales Kapitel-Modell (vor dem Kapitel-LLM; lernt aus jeder Einreihung) ──
+CHAPTER_MODEL = ChapterModel().train_corpus(CORPUS).train_keywords(CHAPTER_KEYWORDS)
+CHAPTER_MODEL_MIN_CONFIDENCE = float(os.environ.get("CHAPTER_MODEL_MIN_CONFIDENCE", "0.5"))
+
+
+LEARNED_CHAPTER_METHODS = ("keywords", "llm")   # nie die eigenen Vorhersagen oder den Fallback
+
+
+def learn_chapter(query, result):
+    """Feed a finished classification into CHAPTER_MODEL.
+
+    Only chapters from the keyword table or an LLM count: _chapter_method
+    keywords/llm, or a guess replaced by the chapter of a valid tariff number
+    (chapter_from). Low-confidence answers and corrected or rejected tariff
+    numbers are skipped.
+    """
+    check = result.get("_tariff_check") or {}
+    if result.get("confidence") == "low" or not result.get("chapter"):
+        return
+    if check.get("status") in ("corrected", "rejected"):
+        return
+    if result.get("_chapter_method") not in LEARNED_CHAPTER_METHODS and "chapter_from" not in check:
+        return
+    CHAPTER_MODEL.learn(chapter_text(query, result.get("_off_product")), result["chapter"])
+
+
+# ── Request coalescing (identische Anfragen teilen sich eine Pipeline-Ausführung) ──
+LOCAL_FLIGHT = SingleFlight()
+CROSS_FLIGHT = CrossWorkerFlight(
+    RESULT_CACHE.path, RESULT_CACHE.get,
+    wait_timeout=float(os.environ.get("COALESCE_WAIT_TIMEOUT", "60"))) if RESULT_CACHE.path else None
+
+
+def result_cache_key(kind, value, token_budget=None, corpus=None):
+    """Cache key for a query ("q") or resolved EAN ("ean"), bound to corpus, prompt version and token budget."""
+    prompt = PROMPT_VERSION
+    if token_budget and token_budget != PROMPT_TOKEN_BUDGET:   # anderes Budget = anderer Prompt
+        prompt = f"{PROMPT_VERSION}-{token_budget}"
+    return f"{(corpus or CORPUS).version}:{prompt}:{kind}:{value}"
+
+
+# ── Wiederverwendung ähnlicher Einreihungen (Packungsgrösse, Schreibweise, Sorte) ──
+SIMILAR_INDEX = SimilarityIndex(maxsize=int(os.environ.get("SIMILARITY_INDEX_SIZE", "20000")))
+SIMILARITY_THRESHOLD = float(os.environ.get("SIMILARITY_THRESHOLD", "0.8"))   # Jaccard; >= 1 = aus
+
+
+def similarity_text(query):
+    """Query without pack sizes, folded like the corpus ("Rivella Rot 1,5 l" → "rivella rot").
+
+    Other numbers stay: "Bier 4.8%" → "bier 4 8".
+    """
+    return ' '.join(tokenize(UNIT_RE.sub(' ', query)))
+
+
+def similarity_numbers(text):
+    """Numbers of a similarity_text(); they decide the tariff (alcohol, juice content) and must match exactly."""
+    return [token for token in text.split() if token.isdigit()]
+
+
+def remember_similar(query, query_key, result):
+    """Index a finished high-confidence classification; the payload is its result-cache key."""
+    if result.get("confidence") != "high" or result.get("_reused_from"):
+        return
+    text = similarity_text(query)
+    if len(similarity_numbers(text)) < len(text.split()):   # nicht nur Zahlen (EAN)
+        SIMILAR_INDEX.add(text, query_key)
+
+
+def find_similar(product_query, corpus=None):
+    """Cached result of a near-identical earlier query, flagged as reused; None if there is none."""
+    if SIMILARITY_THRESHOLD >= 1:
+        return None
+    text = similarity_text(product_query)
+    numbers = similarity_numbers(text)
+    if len(numbers) == len(text.split()):
+        return None   # reine EAN – dafür gibt es den EAN-Cache
+    match = SIMILAR_INDEX.search(text, SIMILARITY_THRESHOLD,
+                                 accept=lambda other: similarity_numbers(other) == numbers)
+    CACHE_LOOKUPS.inc(cache="similar", result="hit" if match else "miss")
+    if match is None:
+        return None
+    similarity, other, key = match
+    value = RESULT_CACHE.get(key) if key.startswith(result_cache_key("q", "", corpus=corpus)) else None
+    if value is None:
+        SIMILAR_INDEX.discard(other)   # abgelaufen oder von einem anderen Korpus-Stand
+        return None
+    return dict(value, cached=True, reused=True, skipped_stages=[],
+                _reused_from={"query": other, "similarity": round(similarity, 3)})
+
+
+def warm_up_from_results():
+    """Train CHAPTER_MODEL and fill SIMILAR_INDEX from earlier classifications (all workers)."""
+    current = result_cache_key("q", "")
+    for key, value in RESULT_CACHE.items():
+        parts = key.split(":", 3)   # corpus:prompt:kind:value, siehe result_cache_key()
+        if len(parts) == 4 and parts[2] == "q":
+            learn_chapter(parts[3], value)
+            if key.startswith(current):
+                remember_similar(parts[3], key, value)
+
+
+warm_up_from_results()
+
+
+# ── Tarifnummern-Prüfung (lokal gegen die Nummern aus den BAZG-Texten, gezielte Korrektur) ──
+TARIFF_INDEX = TariffIndex.from_corpus(CORPUS)
+TARIFF_CORRECTION_MIN_BUDGET = float(os.environ.get("TARIFF_CORRECTION_MIN_BUDGET", "2"))
+TARIFF_PROBLEMS = {
+    "invalid_format": "sie hat nicht das Format XXXX.XXXX",
+    "wrong_chapter": "sie liegt nicht in Kapitel {chapter}",
+    "unknown_heading": "diese Position gibt es in Kapitel {chapter} nicht",
+    "unknown_subheading": "diese Unternummer gibt es unter der Position nicht",
+}
+
+CORRECTION_PROMPT = """Die Tarifnummer "{number}" für dieses Produkt ist ungültig: {problem}.
+Wähle die zutreffende Nummer aus Kapitel {chapter}. Gültige Positionen laut BAZG-Texten:
+{candidates}
+
+Antworte als JSON: {{"tariff_number": "XXXX.XXXX", "tariff_description": "..."}}"""
+
+
+def correct_tariff_number(tariff_index, product_query, result, chapter, check, deadline):
+    """One small LLM call choosing among the valid candidates; (number, description) or None."""
+    candidates = tariff_index.candidates(chapter, result.get("tariff_number"))
+    lines = "\n".join(f"- {code}{': ' + text if text else ''}" for code, text in candidates)
+    prompt = CORRECTION_PROMPT.format(
+        number=result.get("tariff_number"), chapter=chapter,
+        problem=TARIFF_PROBLEMS[check["status"]].format(chapter=chapter),
+        candidates=lines or "(keine aufgeführt – Nummer muss mit {:02d} beginnen)".format(int(chapter)))
+    summary = result.get("tariff_description") or result.get("product_description") or ""
+    try:
+        with stage("tariff_correction"):
+            answer = call_groq([
+                {"role": "system", "content": prompt},
+                {"role": "user", "content": f"Korrigiere: {product_query}\nBisherige Einreihung: {summary}"}
+            ], max_tokens=300, deadline=deadline.expires_at)
+    except Exception:
+        return None
+    corrected = tariff_index.validate(answer.get("tariff_number"), chapter)
+    if corrected["status"] in TARIFF_PROBLEMS:
+        return None
+    return corrected["tariff_number"], answer.get("tariff_description")
+
+
+def check_tariff_number(tariff_index, product_query, result, chapter, chapter_method, deadline):
+    """Validate and normalise result["tariff_number"] in place; on a mismatch one targeted correction.
+
+    Unless the chapter came from the chapter LLM, it is only a guess: a valid
+    number from another chapter wins and moves result["chapter"] there, and a
+    correction is only ever asked for within the number's own chapter. A
+    corrected number is at most "medium"; one that stays invalid is kept
+    (normalised if possible) with confidence "low", so it is neither learned
+    nor reused.
+    """
+    original = result.get("tariff_number")
+    check = tariff_index.validate(original, chapter)
+    guessed_chapter = None
+    if check["status"] == "wrong_chapter" and chapter_method != "llm":
+        guessed_chapter, chapter = chapter, int(check["tariff_number"][:2])
+        result["chapter"] = chapter
+        check = tariff_index.validate(original, chapter)
+    status = check["status"]
+    if status in TARIFF_PROBLEMS:
+        corrected = None
+        if deadline.allows(TARIFF_CORRECTION_MIN_BUDGET):
+            corrected = correct_tariff_number(tariff_index, product_query, result, chapter, check, deadline)
+        else:
+            deadline.skip("tariff_correction")
+        if corrected is not None:
+            result["tariff_number"], description = corrected
+            result["chapter"] = chapter
+            if description:
+                result["tariff_description"] = description
+            if result.get("confidence") == "high":
+                result["confidence"] = "medium"
+            status = "corrected"
+        else:
+            result["tariff_number"] = check["tariff_number"] or original
+            result["confidence"] = "low"
+            status = "rejected"
+    elif check["normalized"]:
+        result["tariff_number"] = check["tariff_number"]
+    number = normalize_number(result.get("tariff_number"))
+    if number:
+        result["position"] = number[:4]
+    TARIFF_CHECKS.inc(status=status)
+    result["_tariff_check"] = {"status": status}
+    if status in ("corrected", "rejected"):
+        result["_tariff_check"]["problem"] = check["status"]
+    if result.get("tariff_number") != original:
+        result["_tariff_check"]["original"] = original
+    if guessed_chapter is not None:
+        result["_tariff_check"]["chapter_from"] = guessed_chapter
+
+
+# Ein Request arbeitet durchgehend mit einem Stand: swap_corpus() ersetzt alle drei zusammen
+CorpusState = namedtuple("CorpusState", "corpus chapter_model tariff_index")
+CORPUS_LOCK = threading.Lock()
+
+
+def corpus_state():
+    """Consistent snapshot of CORPUS, CHAPTER_MODEL and TARIFF_INDEX for one request."""
+    with CORPUS_LOCK:
+        return CorpusState(CORPUS, CHAPTER_MODEL, TARIFF_INDEX)
+
+
+def swap_corpus(path):
+    """Switch this worker to a new corpus bundle (BundleWatcher callback).
+
+    The chapter model and the tariff-number index are rebuilt from the new texts before the swap. Result
+    keys carry the corpus version, so old entries are never hit again; the
+    in-memory tier and the similarity index are rebuilt for the new version.
+    """
+    global CORPUS, CHAPTER_MODEL, TARIFF_INDEX
+    corpus = CorpusStore(CACHE_DIR).load_bundle(path)
+    if corpus.version == CORPUS.version:
+        return
+    model = ChapterModel().train_corpus(corpus).train_keywords(CHAPTER_KEYWORDS)
+    tariff_index = TariffIndex.from_corpus(corpus)
+    with CORPUS_LOCK:
+        CORPUS, CHAPTER_MODEL, TARIFF_INDEX = corpus, model, tariff_index
+    RESULT_CACHE.memory.clear()
+    SIMILAR_INDEX.clear()
+    warm_up_from_results()
+
+
+CORPUS_WATCHER.start()
+
+
+# ── Zeitbudget pro Request (Client: "time_budget" in Sekunden) ──
+REQUEST_TIME_BUDGET = float(os.environ.get("REQUEST_TIME_BUDGET", "30"))
+MIN_TIME_BUDGET, MAX_TIME_BUDGET = 5.0, 55.0   # Obergrenze unter dem gunicorn-Timeout (60 s)
+# Reserve für die finale LLM-Einreihung; Vorstufen bekommen nur, was darüber hinaus bleibt
+LLM_RESERVE = float(os.environ.get("LLM_RESERVE", "10"))
+WEB_SEARCH_MIN_BUDGET = float(os.environ.get("WEB_SEARCH_MIN_BUDGET", "6"))
+CHAPTER_LLM_MIN_BUDGET = float(os.environ.get("CHAPTER_LLM_MIN_BUDGET", "3"))
+LOOKUP_MIN_BUDGET = 1.0
+FINAL_LLM_MIN_BUDGET = 2.0
+
+
+def _no_event(name, data):
+    pass
+
+
+def deadline_error(deadline, message="Zeitbudget des Requests überschritten"):
+    return {"error": message, "deadline_exceeded": True, "skipped_stages": list(deadline.skipped),
+            "time_budget": deadline.budget}
+
+
+def classify_product(product_query, on_event=None, token_budget=None, time_budget=None):
+    """Main classification pipeline.
+
+    on_event(name, data) is called as each stage finishes ("product",
+    "chapter", "docs", then "token" per streamed LLM delta); with it the
+    final Groq completion is streamed. token_budget overrides
+    PROMPT_TOKEN_BUDGET for the classification prompt, time_budget
+    (seconds) overrides REQUEST_TIME_BUDGET for the whole request.
+    """
+    deadline = Deadline(time_budget or REQUEST_TIME_BUDGET)
+    token = request_deadline.CURRENT.set(deadline)  # läuft über copy_context() in die Lookup-Threads mit
+    try:
+        with stage("total"):
+            result = _classify(product_query, on_event, token_budget, deadline)
+    finally:
+        request_deadline.CURRENT.reset(token)
+    CLASSIFICATIONS.inc(outcome=classification_outcome(result))
+    return result
+
+
+def classification_outcome(result):
+    if result.get("deadline_exceeded"):
+        return "deadline_exceeded"
+    if "error" in result:
+        return "error"
+    if result.get("coalesced"):
+        return "coalesced"
+    if result.get("reused"):
+        return "reused"
+    return "cached" if result.get("cached") else "classified"
+
+
+def cached_result(key):
+    """RESULT_CACHE.get() that counts hits and misses for /metrics."""
+    value = RESULT_CACHE.get(key)
+    CACHE_LOOKUPS.inc(cache="result", result="hit" if value is not None else "miss")
+    return value
+
+
+def _classify(product_query, on_event, token_budget, deadline):
+    state = corpus_state()
+    query_key = result_cache_key("q", normalize_query(product_query), token_budget, state.corpus)
+    cached = cached_result(query_key)
+    if cached is not None:
+        return dict(cached, cached=True, skipped_stages=[])
+    default_budget = token_budget in (None, PROMPT_TOKEN_BUDGET)   # der Ähnlichkeitsindex kennt nur diese
+    reused = find_similar(product_query, state.corpus) if default_budget else None
+    if reused is not None:
+        return reused
+    if on_event:
+        return _run_pipeline(state, product_query, query_key, on_event, token_budget)  # Stream: eigener Lauf
+
+    def run():
+        if CROSS_FLIGHT:
+            return CROSS_FLIGHT.do(
+                query_key, lambda: _run_pipeline(state, product_query, query_key, None, token_budget),
+                wait_timeout=deadline.remaining())
+        return _run_pipeline(state, product_query, query_key, None, token_budget), False
 
+    try:
+        (result, from_other_worker), shared = LOCAL_FLIGHT.do(query_key, run, timeout=deadline.remaining())
+    except TimeoutError:
+        return deadline_error(deadline)
+    if shared or from_other_worker:
+        return dict(result, cached=from_other_worker or result.get("cached", False), coalesced=True)
+    return result
 
-def classify_product(product_query):
-    """Main classification pipeline."""
-    # Step 1: Try Open Food Facts
-    off_data = search_openfoodfacts(product_query)
-    web_data = None
-    data_source = "none"
 
-    if off_data:
-        data_source = "off"
+def _run_pipeline(state, product_query, query_key, on_event, token_budget):
+    emit = on_event or _no_event
+    corpus = state.corpus
+    deadline = request_deadline.current() or Deadline(REQUEST_TIME_BUDGET)
+
+    # Step 1: Product data (Open Food Facts, web search as fallback – concurrently)
+    lookup_budget = deadline.remaining() - LLM_RESERVE
+    if lookup_budget >= LOOKUP_MIN_BUDGET:
+        web_search = lookup_budget >= WEB_SEARCH_MIN_BUDGET
+        if not web_search:
+            deadline.skip("web_search")
+        with stage("product_lookup"):
+            product_info, data_source = acquire_product_data(product_query, timeout=lookup_budget,
+                                                             web_search=web_search)
     else:
-        web_data = web_search_product(product_query)
-        if web_data:
-            data_source = "web"
+        deadline.skip("product_lookup")
+        product_info, data_source = None, "none"
+    DATA_SOURCE.inc(source=data_source)
+    emit("product", {
+        "data_source": data_source,
+        "source": product_info.get("source", "") if product_info else "",
+        "name": product_info.get("name", "") if product_info else "",
+        "ean": product_info.get("ean", "") if product_info else ""
+    })
 
-    product_info = off_data or web_data
+    ean_key = None
+    if product_info and product_info.get("ean"):
+        ean_key = result_cache_key("ean", product_info["ean"], token_budget, corpus)
+        cached = cached_result(ean_key)
+        if cached is not None:
+            RESULT_CACHE.set(query_key, cached)
+            return dict(cached, cached=True, skipped_stages=[])
 
     # Step 2: Determine chapter
-    chapter = guess_chapter(product_query, product_info)
+    with stage("chapter_keywords"):
+        chapter_match = explain_chapter(product_query, product_info)
+    chapter = keyword_chapter(chapter_match, state.chapter_model, chapter_text(product_query, product_info))
+    chapter_method = "keywords"
+    candidates = []
     if chapter is None:
+        with stage("chapter_model"):
+            candidates = state.chapter_model.predict(chapter_text(product_query, product_info))
+        if candidates and candidates[0][1] >= CHAPTER_MODEL_MIN_CONFIDENCE:
+            chapter, chapter_method = candidates[0][0], "model"
+    if chapter is None and not deadline.allows(LLM_RESERVE + CHAPTER_LLM_MIN_BUDGET):
+        deadline.skip("chapter_llm")
+    elif chapter is None:
+        chapter_method = "llm"
         try:
             ingredients_hint = ""
             if product_info:
                 ingredients_hint = f"\nZutaten/Material: {product_info.get('ingredients', '')}"
-            ch_result = call_groq([
-                {"role": "system", "content": "Bestimme das Kapitel (1-97) des Schweizer Zolltarifs für dieses Produkt. Antworte als JSON: {\"chapter\": 22, \"reason\": \"...\"}"},
-                {"role": "user", "content": f"Produkt: {product_query}{ingredients_hint}"}
-            ], max_tokens=200)
-            chapter = ch_result.get("chapter", 22)
+            if candidates:
+                ingredients_hint += "\nKandidaten (lokales Modell): " + ", ".join(
+                    f"Kapitel {ch} ({p:.0%})" for ch, p in candidates)
+            with stage("chapter_llm"):
+                ch_result = call_groq([
+                    {"role": "system", "content": "Bestimme das Kapitel (1-97) des Schweizer Zolltarifs für dieses Produkt. Antworte als JSON: {\"chapter\": 22, \"reason\": \"...\"}"},
+                    {"role": "user", "content": f"Produkt: {product_query}{ingredients_hint}"}
+                ], max_tokens=200, deadline=deadline.expires_at - LLM_RESERVE)
+            chapter = parse_chapter(ch_result.get("chapter"))
         except Exception:
-            chapter = 22
-
-    # Step 3: Load BAZG documents
-    docs = get_chapter_docs(chapter)
-    erl_text = docs.get("erlaeuterungen", "[Erläuterungen nicht verfügbar]")
-    anm_text = docs.get("anmerkungen", "[Anmerkungen nicht verfügbar]")
-
-    product_keywords = product_query.split()
-    if product_info:
-        product_keywords += product_info.get('ingredients', '').split()[:20]
-        product_keywords += product_info.get('name', '').split()
-
-    max_chars = 24000
-    if len(erl_text) > max_chars:
-        erl_text = extract_relevant_sections(erl_text, product_keywords)[:max_chars]
-    if len(anm_text) > max_chars:
-        anm_text = anm_text[:max_chars]
-
-    # Step 4: Build product data string
+            chapter = None
+    if chapter is None:   # LLM übersprungen/fehlgeschlagen/unbrauchbar: bester Modell-Kandidat statt pauschal 22
+        chapter, chapter_method = (candidates[0][0], "model_fallback") if candidates else (22, "default")
+    emit("chapter", {"chapter": chapter, "method": chapter_method,
+                     "tie": chapter_match["best"] if chapter_match["tie"] else [],
+                     "candidates": [{"chapter": ch, "p": p} for ch, p in candidates]})
+
+    # Step 3: Build product data string
     if product_info:
         source_label = "Open Food Facts (echte Produktdaten)" if data_source == "off" else "Web-Suche (automatisch recherchiert)"
         desc_line = ""
@@ -478,28 +1060,67 @@ def classify_product(product_query):
             f"Bitte confidence entsprechend tief setzen."
         )
 
+    # Step 4: Pack BAZG documents into the token budget
+    product_keywords = product_query.split()
+    if product_info:
+        product_keywords += product_info.get('ingredients', '').split()[:20]
+        product_keywords += product_info.get('name', '').split()
+
+    user_message = f"Tarifiere: {product_query}"
+    fixed_text = CLASSIFY_PROMPT.format(av_text="", chapter=chapter, erl_text="", anm_text="",
+                                        product_data=product_data_str) + user_message
+    with stage("docs"):
+        av_text, anm_text, erl_text, prompt_usage = pack_context(
+            token_budget or PROMPT_TOKEN_BUDGET, fixed_text, AV_TEXT,
+            (corpus.sections(chapter, "anmerkungen"), corpus.index(chapter, "anmerkungen")),
+            (corpus.sections(chapter, "erlaeuterungen"), corpus.index(chapter, "erlaeuterungen")),
+            product_keywords)
+    PROMPT_TOKENS.observe(prompt_usage["total"])
+    erl_text = erl_text or "[Erläuterungen nicht verfügbar]"
+    anm_text = anm_text or "[Anmerkungen nicht verfügbar]"
+    emit("docs", {"chapter": chapter, "tokens": prompt_usage})
+
     # Step 5: LLM classification
     prompt = CLASSIFY_PROMPT.format(
-        av_text=AV_TEXT,
+        av_text=av_text,
         chapter=chapter,
         erl_text=erl_text,
         anm_text=anm_text,
         product_data=product_data_str
     )
 
+    messages = [
+        {"role": "system", "content": prompt},
+        {"role": "user", "content": user_message}
+    ]
+    if not deadline.allows(FINAL_LLM_MIN_BUDGET):
+        deadline.skip("classification")
+        return deadline_error(deadline)
     try:
-        result = call_groq([
-            {"role": "system", "content": prompt},
-            {"role": "user", "content": f"Tarifiere: {product_query}"}
-        ], max_tokens=3000)
+        with stage("classification"):
+            if on_event:
+                result = call_groq_stream(messages, lambda text: emit("token", {"text": text}), max_tokens=3000,
+                                          deadline=deadline.expires_at)
+            else:
+                result = call_groq(messages, max_tokens=3000, deadline=deadline.expires_at)
     except Exception as e:
+        if isinstance(e, TimeoutError) and not deadline.allows(0.1):
+            return deadline_error(deadline, f"LLM-Einreihung fehlgeschlagen: {e}")
         return {"error": f"LLM-Einreihung fehlgeschlagen: {e}"}
+    check_tariff_number(state.tariff_index, product_query, result, chapter, chapter_method, deadline)
 
     # Add metadata
     result["bazg_docs_used"] = True
     result["data_source"] = data_source
     result["off_data_used"] = data_source == "off"
     result["web_search_used"] = data_source == "web"
+    result["_prompt_tokens"] = prompt_usage
+    if chapter_match["best"]:
+        result["_chapter_match"] = {
+            "scores": chapter_match["scores"],
+            "keywords": {ch: [h["keyword"] for h in hits] for ch, hits in chapter_match["hits"].items()},
+            "tie": chapter_match["best"] if chapter_match["tie"] else []
+        }
     if product_info:
         result["_off_product"] = {
             "name": product_info.get("name", ""),
@@ -507,7 +1128,21 @@ def classify_product(product_query):
             "ean": product_info.get("ean", ""),
             "source": product_info.get("source", "")
         }
-
+    result["_chapter_method"] = chapter_method
+    if candidates:
+        result["_chapter_candidates"] = [{"chapter": ch, "p": p} for ch, p in candidates]
+    learn_chapter(product_query, result)
+
+    # gekürzte Läufe und ungültige Tarifnummern nicht cachen – ein neuer Lauf kann es besser
+    if not deadline.skipped and result["_tariff_check"]["status"] != "rejected":
+        RESULT_CACHE.set(query_key, dict(result))
+        if ean_key:
+            RESULT_CACHE.set(ean_key, dict(result))
+        if token_budget in (None, PROMPT_TOKEN_BUDGET):
+            remember_similar(product_query, query_key, result)
+    result["cached"] = False
+    result["skipped_stages"] = list(deadline.skipped)
+    result["time_budget"] = deadline.budget
     return result
 
 
@@ -515,7 +1150,39 @@ def classify_product(product_query):
 
 @app.route('/health', methods=['GET'])
 def health():
-    return jsonify({"status": "ok", "service": "Tarifierungstool Backend"})
+    return jsonify({"status": "ok", "service": "Tarifierungstool Backend", "http_pool": HTTP.stats(),
+                    "groq_limiter": GROQ_LIMITER.snapshot(),
+                    "off_snapshot": OFF_SNAPSHOT.stats() if OFF_SNAPSHOT else None,
+                    "chapter_model": CHAPTER_MODEL.stats(), "similar_index": SIMILAR_INDEX.stats(),
+                    "corpus": dict(CORPUS.stats(), watcher=CORPUS_WATCHER.stats()),
+                    "tariff_index": TARIFF_INDEX.stats()})
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return Response(METRICS.render(), mimetype="text/plain; version=0.0.4")
+
+
+def parse_token_budget(data):
+    """Optional per-request prompt budget, clamped to MIN/MAX_TOKEN_BUDGET."""
+    token_budget = data.get("token_budget")
+    if token_budget is None:
+        return None
+    try:
+        return max(MIN_TOKEN_BUDGET, min(int(token_budget), MAX_TOKEN_BUDGET))
+    except (TypeError, ValueError):
+        raise ValueError("Ungültiges token_budget")
+
+
+def parse_time_budget(data):
+    """Optional per-request time budget in seconds, clamped to MIN/MAX_TIME_BUDGET."""
+    time_budget = data.get("time_budget")
+    if time_budget is None:
+        return None
+    try:
+        return max(MIN_TIME_BUDGET, min(float(time_budget), MAX_TIME_BUDGET))
+    except (TypeError, ValueError):
+        raise ValueError("Ungültiges time_budget")
 
 
 @app.route('/classify', methods=['POST'])
@@ -528,14 +1195,182 @@ def classify():
         return jsonify({"error": "Kein Produkt angegeben"}), 400
 
     product_query = data["product"].strip()
-    result = classify_product(product_query)
+    try:
+        token_budget = parse_token_budget(data)
+        time_budget = parse_time_budget(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if data.get("debug"):
+        with collect_timings() as timings:
+            result = classify_product(product_query, token_budget=token_budget, time_budget=time_budget)
+        result = dict(result, _timings=timings)
+    else:
+        result = classify_product(product_query, token_budget=token_budget, time_budget=time_budget)
 
     if "error" in result:
-        return jsonify(result), 500
+        return jsonify(result), 504 if result.get("deadline_exceeded") else 500
 
     return jsonify(result)
 
 
+# ── Streaming classification (Server-Sent Events) ──
+SSE_HEARTBEAT = float(os.environ.get("SSE_HEARTBEAT", "10"))
+
+
+def sse_event(name, data):
+    return f"event: {name}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def stream_classification(product_query, token_budget=None, time_budget=None):
+    """Run classify_product() in a thread and yield its stage events as SSE frames."""
+    events = queue.Queue()
+
+    def worker():
+        try:
+            result = classify_product(product_query, on_event=lambda name, data: events.put((name, data)),
+                                      token_budget=token_budget, time_budget=time_budget)
+        except Exception as e:
+            result = {"error": f"Klassifizierung fehlgeschlagen: {e}"}
+        events.put(("error" if "error" in result else "result", result))
+        events.put(None)
+
+    threading.Thread(target=worker, name="classify-stream", daemon=True).start()
+    while True:
+        try:
+            item = events.get(timeout=SSE_HEARTBEAT)
+        except queue.Empty:
+            yield ": keep-alive\n\n"  # hält die Verbindung offen, zeigt dem Client: Upstream läuft noch
+            continue
+        if item is None:
+            return
+        yield sse_event(*item)
+
+
+@app.route('/classify/stream', methods=['GET', 'POST'])
+def classify_stream():
+    if not GROQ_API_KEY:
+        return jsonify({"error": "GROQ_API_KEY nicht konfiguriert"}), 500
+
+    data = request.get_json(silent=True) if request.method == 'POST' else request.args
+    product_query = ((data or {}).get("product") or "").strip()
+    if not product_query:
+        return jsonify({"error": "Kein Produkt angegeben"}), 400
+
+    try:
+        token_budget = parse_token_budget(data)
+        time_budget = parse_time_budget(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    return Response(stream_with_context(stream_classification(product_query, token_budget, time_budget)),
+                    mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+# ── Batch classification ──
+BATCH_CONCURRENCY = int(os.environ.get("BATCH_CONCURRENCY", "4"))
+BATCH_MAX_CONCURRENCY = int(os.environ.get("BATCH_MAX_CONCURRENCY", "8"))
+BATCH_MAX_ITEMS = int(os.environ.get("BATCH_MAX_ITEMS", "500"))
+
+
+def plan_batch(queries):
+    """De-duplicate queries and order them by guessed chapter.
+
+    Returns a list of {"product", "indexes", "chapter"}; items of the same
+    chapter run back to back so they work on the same corpus sections.
+    """
+    items = {}
+    for index, query in enumerate(queries):
+        key = normalize_query(query)
+        if key in items:
+            items[key]["indexes"].append(index)
+        else:
+            items[key] = {"product": query, "indexes": [index], "chapter": guess_chapter(query)}
+    return sorted(items.values(), key=lambda item: (item["chapter"] is None, item["chapter"] or 0, item["indexes"][0]))
+
+
+def _classify_batch_item(item, time_budget=None):
+    token = PRIORITY.set(BATCH)  # Batch-Arbeit wartet im Groq-Limiter hinter interaktiven Requests
+    try:
+        result = classify_product(item["product"], time_budget=time_budget)
+    except Exception as e:
+        result = {"error": f"Klassifizierung fehlgeschlagen: {e}"}
+    finally:
+        PRIORITY.reset(token)
+    line = {"indexes": item["indexes"], "product": item["product"]}
+    if "error" in result:
+        line["error"] = result["error"]
+    else:
+        line["result"] = result
+    return line
+
+
+def run_batch(plan, concurrency, time_budget=None):
+    """Classify planned items with at most `concurrency` in flight; yields NDJSON lines as they finish.
+
+    time_budget applies to each item from the moment it starts.
+    """
+    pool = make_pool(concurrency, "batch")
+    pending = set()
+    todo = list(reversed(plan))
+    errors = 0
+    try:
+        while todo or pending:
+            while todo and len(pending) < concurrency:
+                pending.add(pool.submit(_classify_batch_item, todo.pop(), time_budget))
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                line = future.result()
+                errors += "error" in line
+                yield json.dumps(line, ensure_ascii=False) + "\n"
+        yield json.dumps({"done": True, "unique": len(plan), "errors": errors}) + "\n"
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def parse_batch_queries(data):
+    """Non-empty entries of "products" and "eans"; each field must be a list of strings."""
+    queries = []
+    for field in ("products", "eans"):
+        values = data.get(field) or []
+        if not isinstance(values, list) or not all(isinstance(v, str) for v in values):
+            raise ValueError(f"{field} muss eine Liste von Strings sein")
+        queries.extend(v.strip() for v in values)
+    return [q for q in queries if q]
+
+
+@app.route('/classify/batch', methods=['POST'])
+def classify_batch():
+    if not GROQ_API_KEY:
+        return jsonify({"error": "GROQ_API_KEY nicht konfiguriert"}), 500
+
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data, dict):
+        return jsonify({"error": "JSON-Objekt erwartet"}), 400
+    try:
+        queries = parse_batch_queries(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if not queries:
+        return jsonify({"error": "Keine Produkte angegeben"}), 400
+    if len(queries) > BATCH_MAX_ITEMS:
+        return jsonify({"error": f"Zu viele Produkte (max. {BATCH_MAX_ITEMS})"}), 400
+
+    try:
+        concurrency = int(data.get("concurrency", BATCH_CONCURRENCY))
+    except (TypeError, ValueError):
+        return jsonify({"error": "Ungültige concurrency"}), 400
+    concurrency = max(1, min(concurrency, BATCH_MAX_CONCURRENCY))
+    try:
+        time_budget = parse_time_budget(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    plan = plan_batch(queries)
+    return Response(stream_with_context(run_batch(plan, concurrency, time_budget)),
+                    mimetype="application/x-ndjson")
+
+
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 10000))
     app.run(host='0.0.0.0', port=port)
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+Lasttest – Requests pro Worker für /classify gegen einen lokalen Upstream-Stub.
+
+Startet bench/stub_upstream.py im Prozess und gunicorn mit der gewählten
+Worker-Klasse, feuert `--requests` Produkte mit `--concurrency` parallelen
+Clients und gibt Durchsatz, Latenzen (p50/p95/p99), die Aufteilung auf die
+Pipeline-Stufen und die Upstream-Statuscodes aus.
+
+    python bench/loadtest.py --compare                    # sync vs. gthread
+    python bench/loadtest.py --worker-class gthread --threads 32 --requests 200
+    python bench/loadtest.py --mix bench/products.txt --replay bench/fixtures/upstream.jsonl \\
+        --cold --groq-429-rate 0.05 --groq-error-rate 0.02 --off-error-rate 0.05
+"""
+import argparse, json, os, re, socket, subprocess, sys, tempfile, threading, time, urllib.error, urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from stub_upstream import make_server
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def load_mix(path):
+    with open(path, encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith("#")]
+
+
+def start_app(port, upstream, worker_class, workers, threads, extra_env=None):
+    env = dict(os.environ)
+    env.update({
+        "PORT": str(port),
+        "GROQ_API_KEY": "stub",
+        "GROQ_URL": f"{upstream}/openai/v1/chat/completions",
+        "OFF_BASE_URL": upstream,
+        "RESULT_CACHE_PATH": "",
+        "WEB_CONCURRENCY": str(workers),
+        "GUNICORN_WORKER_CLASS": worker_class,
+        "GUNICORN_THREADS": str(threads),
+        "METRICS_DIR": tempfile.mkdtemp(prefix="tarif-metrics-"),
+        "METRICS_FLUSH_INTERVAL": "0.5",
+    })
+    env.update(extra_env or {})
+    proc = subprocess.Popen([sys.executable, "-m", "gunicorn", "app:app", "-c", "gunicorn.conf.py",
+                             "--access-logfile", "/dev/null"],
+                            cwd=ROOT_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base = f"http://127.0.0.1:{port}"
+    for _ in range(100):
+        try:
+            urllib.request.urlopen(f"{base}/health", timeout=1).read()
+            return proc, base
+        except OSError:
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError("App startet nicht")
+
+
+def classify(base, product, timeout=120):
+    """One /classify call with debug timings → (status, seconds, timings)."""
+    req = urllib.request.Request(f"{base}/classify",
+                                 data=json.dumps({"product": product, "debug": True}).encode("utf-8"),
+                                 headers={"Content-Type": "application/json"})
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            body = resp.read()
+            status = resp.status
+    except urllib.error.HTTPError as e:
+        body, status = e.read(), e.code
+    except OSError:
+        return "error", time.perf_counter() - start, {}
+    elapsed = time.perf_counter() - start
+    try:
+        timings = json.loads(body).get("_timings") or {}
+    except ValueError:
+        timings = {}
+    return status, elapsed, timings
+
+
+def stage_breakdown(results):
+    """Per stage: how many requests ran it and p50/p95 of its time per request (ms, summed over calls)."""
+    per_stage = {}
+    for _, _, timings in results:
+        for stage, durations in timings.items():
+            per_stage.setdefault(stage, []).append(sum(durations))
+    return {stage: {"n": len(values), "p50_ms": round(percentile(values, 50), 1),
+                    "p95_ms": round(percentile(values, 95), 1)}
+            for stage, values in sorted(per_stage.items(), key=lambda item: -percentile(item[1], 50))}
+
+
+def drive(base, products, concurrency):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        results = list(pool.map(lambda p: classify(base, p), products))
+    elapsed = time.perf_counter() - start
+    latencies = [lat for status, lat, _ in results if status == 200]
+    statuses = {}
+    for status, _, _ in results:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    return {
+        "requests": len(products),
+        "ok": len(latencies),
+        "statuses": statuses,
+        "elapsed_s": round(elapsed, 2),
+        "rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "p50_s": round(percentile(latencies, 50), 3),
+        "p95_s": round(percentile(latencies, 95), 3),
+        "p99_s": round(percentile(latencies, 99), 3),
+        "stages": stage_breakdown(results),
+    }
+
+
+METRIC_LINE = re.compile(r'^tarif_upstream_requests_total\{upstream="([^"]*)",status="([^"]*)"\} (\S+)$')
+
+
+def upstream_statuses(base):
+    """Outbound request counts per status as the app saw them (from /metrics)."""
+    time.sleep(1.0)   # Worker schreiben ihre Metriken alle 0.5 s
+    with urllib.request.urlopen(f"{base}/metrics", timeout=5) as resp:
+        text = resp.read().decode("utf-8")
+    counts = {}
+    for line in text.splitlines():
+        m = METRIC_LINE.match(line)
+        if m:
+            counts[m.group(2)] = counts.get(m.group(2), 0) + int(float(m.group(3)))
+    return counts
+
+
+def products_for(requests, run_id="", mix=None):
+    if mix:
+        return [mix[i % len(mix)] for i in range(requests)]
+    return [f"Stub Getränk {run_id}{i}" for i in range(requests)]
+
+
+def run(worker_class, workers, threads, requests, concurrency, groq_latency, off_latency, run_id="",
+        mix=None, cold=False, stub_options=None):
+    stub = make_server(0, groq_latency, off_latency, **(stub_options or {}))
+    threading.Thread(target=stub.serve_forever, daemon=True).start()
+    upstream = f"http://127.0.0.1:{stub.server_address[1]}"
+    # kalt: keine Ergebnis-/OFF-Caches – jeder Request läuft durch die ganze Pipeline
+    extra_env = {"RESULT_CACHE_TTL": "0", "OFF_CACHE_TTL": "0", "OFF_NEGATIVE_TTL": "0",
+                 "OFF_ERROR_TTL": "0"} if cold else None
+    proc, base = start_app(free_port(), upstream, worker_class, workers, threads, extra_env)
+    try:
+        report = drive(base, products_for(requests, run_id, mix), concurrency)
+        report["upstream_statuses"] = upstream_statuses(base)
+    finally:
+        proc.terminate()
+        proc.wait(timeout=10)
+        stub.shutdown()
+    report.update({"worker_class": worker_class, "workers": workers, "threads": threads,
+                   "rps_per_worker": round(report["rps"] / workers, 2), "stub": dict(stub.counts)})
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--worker-class", default="gthread")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=64)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--groq-latency", type=float, default=0.5)
+    parser.add_argument("--off-latency", type=float, default=0.1)
+    parser.add_argument("--compare", action="store_true", help="sync und gthread nacheinander messen")
+    parser.add_argument("--mix", help="Produktmix (eine Anfrage pro Zeile, z.B. bench/products.txt)")
+    parser.add_argument("--cold", action="store_true", help="Ergebnis- und OFF-Cache abschalten")
+    parser.add_argument("--replay", help="aufgezeichnete Upstream-Antworten (JSONL)")
+    parser.add_argument("--groq-error-rate", type=float, default=0.0)
+    parser.add_argument("--groq-429-rate", type=float, default=0.0)
+    parser.add_argument("--off-error-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    mix = load_mix(args.mix) if args.mix else None
+    stub_options = {"replay": args.replay, "groq_error_rate": args.groq_error_rate,
+                    "groq_throttle_rate": args.groq_429_rate, "off_error_rate": args.off_error_rate,
+                    "seed": args.seed}
+    classes = ["sync", "gthread"] if args.compare else [args.worker_class]
+    for worker_class in classes:
+        report = run(worker_class, args.workers, args.threads if worker_class == "gthread" else 1,
+                     args.requests, args.concurrency, args.groq_latency, args.off_latency, run_id=worker_class,
+                     mix=mix, cold=args.cold, stub_options=stub_options)
+        print(json.dumps(report, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Micro-Benchmarks für die CPU-Teile der Pipeline über den echten bazg_cache-Korpus:
+guess_chapter, get_chapter_docs, relevant_text und pack_context.
+
+    python bench/microbench.py
+    python bench/microbench.py --repeat 2000 --only guess_chapter
+"""
+import argparse, json, os, sys, time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT_DIR)
+os.environ.setdefault("RESULT_CACHE_PATH", "")   # kein SQLite-File neben dem Repo anlegen
+
+import app
+from loadtest import load_mix, percentile
+
+# Produkt-Keywords wie in _run_pipeline (Anfrage + Zutaten + Name)
+CASES = [
+    (2, "Rindfleisch gefroren ohne Knochen Entrecôte"),
+    (4, "Naturjoghurt Vollmilch Rahm 180 g"),
+    (22, "Rivella Rot 500 ml Wasser Milchserum Zucker Kohlensäure Säuerungsmittel"),
+    (18, "Ovomaltine Crunchy Cream Zucker Pflanzenöle Gerstenmalzextrakt Magermilch Kakao Haselnüsse"),
+    (15, "Olivenöl extra vergine nativ"),
+    (9, "Nespresso Kapseln Ristretto Röstkaffee gemahlen"),
+    (84, "Bosch Akkuschrauber GSR 12V Bohrschrauber Elektromotor"),
+    (61, "Baumwoll T-Shirt Herren gewirkt"),
+]
+
+
+def measure(fn, repeat):
+    """Per-call times in µs; a few warm-up calls first."""
+    for _ in range(min(10, repeat)):
+        fn()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - start) * 1e6)
+    return {"calls": repeat, "mean_us": round(sum(times) / len(times), 1),
+            "p50_us": round(percentile(times, 50), 1), "p95_us": round(percentile(times, 95), 1),
+            "p99_us": round(percentile(times, 99), 1)}
+
+
+def cycle(items):
+    state = {"i": 0}
+
+    def next_item():
+        item = items[state["i"] % len(items)]
+        state["i"] += 1
+        return item
+    return next_item
+
+
+def benchmarks(mix):
+    queries = cycle(mix)
+    chapters = cycle([chapter for chapter, _ in CASES])
+    cases = cycle(CASES)
+    kinds = {}
+    for chapter, _ in CASES:   # Erläuterungen liegen nicht für jedes Kapitel vor
+        kinds[chapter] = "erlaeuterungen" if app.CORPUS.sections(chapter, "erlaeuterungen") else "anmerkungen"
+
+    def extract():
+        chapter, keywords = cases()
+        return app.CORPUS.relevant_text(chapter, kinds[chapter], keywords.split())
+
+    def pack():
+        chapter, keywords = cases()
+        return app.pack_context(
+            app.PROMPT_TOKEN_BUDGET, app.CLASSIFY_PROMPT, app.AV_TEXT,
+            (app.CORPUS.sections(chapter, "anmerkungen"), app.CORPUS.index(chapter, "anmerkungen")),
+            (app.CORPUS.sections(chapter, "erlaeuterungen"), app.CORPUS.index(chapter, "erlaeuterungen")),
+            keywords.split())
+
+    return {
+        "guess_chapter": lambda: app.guess_chapter(queries()),
+        "get_chapter_docs": lambda: app.get_chapter_docs(chapters()),
+        "relevant_text": extract,
+        "pack_context": pack,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=500)
+    parser.add_argument("--mix", default=os.path.join(BENCH_DIR, "products.txt"))
+    parser.add_argument("--only", action="append", help="nur diesen Benchmark (mehrfach möglich)")
+    args = parser.parse_args()
+
+    print(json.dumps({"corpus": app.CORPUS.version}))
+    for name, fn in benchmarks(load_mix(args.mix)).items():
+        if args.only and name not in args.only:
+            continue
+        print(json.dumps(dict(measure(fn, args.repeat), benchmark=name)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+"""
+Lokaler Stub für Groq und Open Food Facts mit einstellbarer Latenz, Fehler-
+und 429-Quote. Aufgezeichnete Antworten (JSONL, siehe bench/fixtures/) werden
+abgespielt, alles andere synthetisch beantwortet.
+
+    python bench/stub_upstream.py --port 18080 --groq-latency 2.0 --off-latency 0.3
+    python bench/stub_upstream.py --replay bench/fixtures/upstream.jsonl --groq-429-rate 0.05
+
+Aufzeichnen (leitet unbekannte Requests an die echten Upstreams weiter):
+    GROQ_API_KEY=... python bench/stub_upstream.py --record bench/fixtures/recorded.jsonl
+
+App darauf zeigen lassen:
+    GROQ_URL=http://127.0.0.1:18080/openai/v1/chat/completions OFF_BASE_URL=http://127.0.0.1:18080
+"""
+import argparse, json, os, random, re, threading, time, urllib.error, urllib.request, zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+REAL_GROQ_URL = "https://api.groq.com/openai/v1/chat/completions"
+REAL_OFF_URL = "https://world.openfoodfacts.org"
+
+CLASSIFICATION = {
+    "product_identified": "Stub-Produkt",
+    "chapter": 22,
+    "position": "2202",
+    "tariff_number": "2202.1000",
+    "tariff_description": "Wasser mit Zusatz von Zucker oder Aromastoffen",
+    "mwst_rate": "2.6%",
+    "confidence": "high",
+    "decision_path": [],
+    "keywords": ["stub"]
+}
+
+
+def off_product(name, code="7610000000000"):
+    return {"product_name": name, "brands": "Stub", "ingredients_text": "Zutaten: Wasser, Zucker, Aroma",
+            "categories": "Getränke, Erfrischungsgetränke", "quantity": "500 ml", "code": code}
+
+
+def _norm(text):
+    return " ".join(text.lower().split())
+
+
+def request_key(method, path, body=None):
+    """Replay key of an upstream request, e.g. "off:ean:7610…", "off:search:rivella", "groq:classify:rivella rot"."""
+    if method == "GET":
+        url = urlsplit(path)
+        m = re.match(r'^/api/v2/product/(\d+)\.json$', url.path)
+        if m:
+            return f"off:ean:{m.group(1)}"
+        if url.path == "/cgi/search.pl":
+            return f"off:search:{_norm(parse_qs(url.query).get('search_terms', [''])[0])}"
+        return None
+    user = next((m.get("content", "") for m in (body or {}).get("messages", []) if m.get("role") == "user"), "")
+    if (body or {}).get("model") == "groq/compound":
+        m = re.search(r"Produkt: '(.*?)'\.", user)
+        return f"groq:web:{_norm(m.group(1))}" if m else None
+    m = re.match(r'Tarifiere: (.*)', user)
+    if m:
+        return f"groq:classify:{_norm(m.group(1))}"
+    m = re.match(r'Korrigiere: ([^\n]*)', user)
+    if m:
+        return f"groq:correct:{_norm(m.group(1))}"
+    m = re.match(r'Produkt: ([^\n]*)', user)
+    return f"groq:chapter:{_norm(m.group(1))}" if m else None
+
+
+def load_fixtures(path):
+    """{key: {"status", "body"}} from a JSONL file of recorded responses (later lines win)."""
+    fixtures = {}
+    if path and os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    fixtures[entry["key"]] = {"status": entry.get("status", 200), "body": entry["body"]}
+    return fixtures
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    groq_latency = 0.0
+    off_latency = 0.0
+    groq_error_rate = 0.0
+    groq_throttle_rate = 0.0
+    off_error_rate = 0.0
+    stream_close = False   # SSE ohne Chunked-Encoding, Ende per "Connection: close"
+    fixtures = {}
+    record_path = None
+    rng = random.Random()
+    lock = threading.Lock()
+    counts = None
+
+    def log_message(self, *args):
+        pass
+
+    def count(self, name):
+        if self.counts is not None:
+            with self.lock:
+                self.counts[name] = self.counts.get(name, 0) + 1
+
+    def inject_failure(self, upstream):
+        """Answer with 429/503 according to the configured rates; True if a failure was sent."""
+        with self.lock:
+            roll = self.rng.random()
+        throttle = self.groq_throttle_rate if upstream == "groq" else 0.0
+        error = self.groq_error_rate if upstream == "groq" else self.off_error_rate
+        if roll < throttle:
+            self.count(f"{upstream}_429")
+            self.send_json(429, {"error": {"message": "Rate limit reached"}},
+                           {"retry-after": "1", "x-ratelimit-remaining-requests": "0",
+                            "x-ratelimit-reset-requests": "1s"})
+            return True
+        if roll < throttle + error:
+            self.count(f"{upstream}_503")
+            self.send_json(503, {"error": {"message": "Service unavailable"}})
+            return True
+        return False
+
+    def replay(self, key, upstream, body=None):
+        """Recorded response for key (recorded on the fly with --record); None if there is none."""
+        entry = self.fixtures.get(key) if key else None
+        if entry is None and key and self.record_path:
+            entry = self.record(key, upstream, body)
+        if entry is not None:
+            self.count(f"{upstream}_replayed")
+        return entry
+
+    def record(self, key, upstream, body):
+        if upstream == "off":
+            req = urllib.request.Request(REAL_OFF_URL + self.path, headers={"User-Agent": "Tarifierungstool/4.0"})
+        else:
+            body = dict(body, stream=False)
+            req = urllib.request.Request(REAL_GROQ_URL, data=json.dumps(body).encode("utf-8"), headers={
+                "Authorization": f"Bearer {os.environ.get('GROQ_API_KEY', '')}",
+                "Content-Type": "application/json"})
+        try:
+            with urllib.request.urlopen(req, timeout=30) as resp:
+                entry = {"status": resp.status, "body": json.loads(resp.read())}
+        except urllib.error.HTTPError as e:
+            if e.code not in (404,):
+                return None   # Fehler nicht aufzeichnen
+            entry = {"status": e.code, "body": {"status": 0}}
+        except (OSError, ValueError):
+            return None
+        with self.lock:
+            self.fixtures[key] = entry
+            with open(self.record_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(dict(entry, key=key), ensure_ascii=False) + "\n")
+        return entry
+
+    def send_json(self, status, obj, headers=None):
+        body = json.dumps(obj).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        time.sleep(self.off_latency)
+        self.count("off_requests")
+        if self.inject_failure("off"):
+            return
+        entry = self.replay(request_key("GET", self.path), "off")
+        if entry is not None:
+            return self.send_json(entry["status"], entry["body"])
+        url = urlsplit(self.path)
+        m = re.match(r'^/api/v2/product/(\d+)\.json$', url.path)
+        if m:
+            if m.group(1).startswith("761"):
+                return self.send_json(200, {"status": 1, "product": off_product(f"Stub {m.group(1)}", m.group(1))})
+            return self.send_json(404, {"status": 0})
+        if url.path == "/cgi/search.pl":
+            terms = parse_qs(url.query).get("search_terms", [""])[0]
+            code = f"761{zlib.crc32(terms.lower().encode('utf-8')):010d}"
+            products = [off_product(terms.title(), code)] if "getränk" in terms.lower() else []
+            return self.send_json(200, {"products": products})
+        self.send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        time.sleep(self.groq_latency)
+        self.count("groq_requests")
+        if self.inject_failure("groq"):
+            return
+        usage = {"prompt_tokens": 1000, "completion_tokens": 200}
+        entry = self.replay(request_key("POST", self.path, body), "groq", body)
+        if entry is not None and entry["status"] != 200:
+            return self.send_json(entry["status"], entry["body"])
+        if entry is not None:
+            content = entry["body"]["choices"][0]["message"]["content"]
+            usage = entry["body"].get("usage") or usage
+        elif body.get("model") == "groq/compound":
+            content = json.dumps({"name": "", "ingredients": ""})
+        elif body.get("max_tokens", 0) <= 200:
+            content = json.dumps({"chapter": 22, "reason": "stub"})
+        else:
+            content = json.dumps(CLASSIFICATION)
+        if not body.get("stream"):
+            return self.send_json(200, {"choices": [{"message": {"content": content}}], "usage": usage})
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        if self.stream_close:
+            self.send_header("Connection", "close")
+            self.close_connection = True
+        else:
+            self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for i in range(0, len(content), 16):
+            self.write_chunk(b"data: " + json.dumps({"choices": [{"delta": {"content": content[i:i + 16]}}]}).encode() + b"\n\n")
+        self.write_chunk(b"data: [DONE]\n\n")
+        if not self.stream_close:
+            self.wfile.write(b"0\r\n\r\n")
+
+    def write_chunk(self, data):
+        self.wfile.write(data if self.stream_close else b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+
+def make_server(port=0, groq_latency=0.0, off_latency=0.0, handler=StubHandler, groq_error_rate=0.0,
+                groq_throttle_rate=0.0, off_error_rate=0.0, replay=None, record=None, seed=None, stream_close=False):
+    """Stub server on 127.0.0.1; server.counts holds request/failure/replay counters."""
+    counts = {}
+    fixtures = load_fixtures(replay)
+    if record:
+        fixtures.update(load_fixtures(record))
+    handler = type("ConfiguredStubHandler", (handler,), {
+        "groq_latency": groq_latency, "off_latency": off_latency, "groq_error_rate": groq_error_rate,
+        "groq_throttle_rate": groq_throttle_rate, "off_error_rate": off_error_rate, "stream_close": stream_close,
+        "fixtures": fixtures,
+        "record_path": record, "rng": random.Random(seed), "lock": threading.Lock(), "counts": counts})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    server.counts = counts
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=18080)
+    parser.add_argument("--groq-latency", type=float, default=2.0)
+    parser.add_argument("--off-latency", type=float, default=0.3)
+    parser.add_argument("--groq-error-rate", type=float, default=0.0, help="Anteil 503-Antworten von Groq")
+    parser.add_argument("--groq-429-rate", type=float, default=0.0, help="Anteil 429-Antworten von Groq")
+    parser.add_argument("--off-error-rate", type=float, default=0.0, help="Anteil 503-Antworten von OFF")
+    parser.add_argument("--replay", help="JSONL mit aufgezeichneten Antworten")
+    parser.add_argument("--record", help="unbekannte Requests weiterleiten und hier aufzeichnen")
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+    server = make_server(args.port, args.groq_latency, args.off_latency, groq_error_rate=args.groq_error_rate,
+                         groq_throttle_rate=args.groq_429_rate, off_error_rate=args.off_error_rate,
+                         replay=args.replay, record=args.record, seed=args.seed)
+    print(f"Stub läuft auf http://127.0.0.1:{server.server_address[1]}")
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,192 @@
+"""
+Caches – In-Memory-LRU mit TTL und ein SQLite-gestützter Ergebnis-Cache,
+der Neustarts der gunicorn-Worker überlebt.
+"""
+import json, re, sqlite3, threading, time, unicodedata
+from collections import OrderedDict
+from contextlib import contextmanager
+
+_MISSING = object()
+
+
+class TTLCache:
+    """Thread-safe LRU cache where every entry also expires after ttl seconds."""
+
+    def __init__(self, maxsize=1000, ttl=3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()   # key → (expires_at, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is not _MISSING:
+                expires_at, value = entry
+                if expires_at > time.time():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._data[key] = (time.time() + (self.ttl if ttl is None else ttl), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        return {"size": len(self._data), "maxsize": self.maxsize, "hits": self.hits, "misses": self.misses}
+
+
+class LookupCache:
+    """Positive and negative cache for upstream lookups (e.g. Open Food Facts).
+
+    Found values are kept for ttl seconds, "not found" answers for
+    negative_ttl and failures (timeouts, HTTP errors) for the shorter
+    error_ttl, so a flaky upstream is retried soon but not on every request.
+    """
+
+    def __init__(self, maxsize=5000, ttl=86400, negative_ttl=3600, error_ttl=60, transient=(), on_count=None):
+        self.transient = transient   # Fehlertypen, die nichts über den Upstream aussagen
+        self.on_count = on_count     # z.B. Export als Metrik
+        self.positive = TTLCache(maxsize, ttl)
+        self.negative = TTLCache(maxsize, negative_ttl)
+        self.error_ttl = error_ttl
+        self._lock = threading.Lock()
+        self.counters = {"hits": 0, "negative_hits": 0, "misses": 0, "not_found": 0, "errors": 0}
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+        if self.on_count is not None:
+            self.on_count(name)
+
+    def lookup(self, key, fetch):
+        """Cached fetch(): returns a copy of the value, or None for (cached) misses and errors."""
+        value = self.positive.get(key)
+        if value is not None:
+            self._count("hits")
+            return dict(value)
+        if self.negative.get(key) is not None:
+            self._count("negative_hits")
+            return None
+        self._count("misses")
+        try:
+            value = fetch()
+        except self.transient:
+            return None
+        except Exception:
+            self._count("errors")
+            self.negative.set(key, "error", ttl=self.error_ttl)
+            return None
+        if value is None:
+            self._count("not_found")
+            self.negative.set(key, "not_found")
+            return None
+        self.positive.set(key, value)
+        return dict(value)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+        stats["size"] = len(self.positive)
+        stats["negative_size"] = len(self.negative)
+        return stats
+
+
+def normalize_query(query):
+    """Canonical form of a product query: NFKC, lowercase, single spaces; EANs as bare digits."""
+    text = unicodedata.normalize("NFKC", query).lower().strip()
+    digits = re.sub(r'\D', '', text)
+    if len(digits) >= 8 and not re.search(r'[a-zäöü]', text):
+        return digits
+    return re.sub(r'\s+', ' ', text)
+
+
+class ResultCache:
+    """Classification results: TTLCache in front of a SQLite table shared by all workers."""
+
+    def __init__(self, path, maxsize=1000, ttl=86400):
+        self.path = path
+        self.ttl = ttl
+        self.memory = TTLCache(maxsize, ttl)
+        self.disk_hits = 0
+        self._writes = 0
+        if self.path:
+            with self._connect() as db:
+                db.execute("PRAGMA journal_mode=WAL")
+                db.execute("CREATE TABLE IF NOT EXISTS results ("
+                           "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)")
+
+    @contextmanager
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=5)
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def get(self, key):
+        value = self.memory.get(key)
+        if value is not None or not self.path:
+            return value
+        try:
+            with self._connect() as db:
+                row = db.execute("SELECT value, expires_at FROM results WHERE key = ?", (key,)).fetchone()
+        except sqlite3.Error:
+            return None
+        if not row or row[1] <= time.time():
+            return None
+        value = json.loads(row[0])
+        self.memory.set(key, value, ttl=row[1] - time.time())
+        self.disk_hits += 1
+        return value
+
+    def set(self, key, value):
+        self.memory.set(key, value)
+        if not self.path:
+            return
+        try:
+            with self._connect() as db:
+                db.execute("INSERT OR REPLACE INTO results (key, value, expires_at) VALUES (?, ?, ?)",
+                           (key, json.dumps(value, ensure_ascii=False), time.time() + self.ttl))
+                self._writes += 1
+                if self._writes % 100 == 0:
+                    db.execute("DELETE FROM results WHERE expires_at <= ?", (time.time(),))
+        except sqlite3.Error:
+            pass  # Cache ist optional – Klassifizierung läuft auch ohne
+
+    def items(self):
+        """(key, value) of all unexpired entries on disk; empty without a file."""
+        if not self.path:
+            return
+        try:
+            with self._connect() as db:
+                rows = db.execute("SELECT key, value FROM results WHERE expires_at > ?", (time.time(),)).fetchall()
+        except sqlite3.Error:
+            return
+        for key, value in rows:
+            yield key, json.loads(value)
+
+    def stats(self):
+        stats = self.memory.stats()
+        stats["disk_hits"] = self.disk_hits
+        return stats
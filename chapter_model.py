@@ -0,0 +1,147 @@
+"""
+Lokales Kapitel-Modell – gewichtete Begriffshäufigkeiten (TF-IDF/BM25) aus den
+BAZG-Texten, der Keyword-Tabelle und bereits gemachten Einreihungen. Liefert in
+Millisekunden gerankte Kapitel; der LLM-Aufruf für das Kapitel ist nur noch bei
+unsicheren Fällen nötig.
+"""
+import math, threading
+from collections import Counter, defaultdict
+from retrieval import normalize, tokenize
+
+MIN_TERM_LEN = 3
+MIN_PART_LEN = 4          # minimale Länge eines Kompositum-Teils
+PART_WEIGHT = 0.5
+KEYWORD_WEIGHT = 20.0     # ein Tabellen-Keyword zählt wie 20 Abschnitte mit dem Begriff
+EXAMPLE_WEIGHT = 5.0      # ein Begriff aus einer früheren Einreihung
+INFLECTIONS = ("en", "er", "es", "e", "n", "s")
+
+
+class ChapterModel:
+    """Chapters as documents, ranked with BM25 over weighted term counts.
+
+    Term counts per chapter come from the corpus (number of sections that
+    contain the term), from the chapter keyword table and from past
+    classifications added with learn(). Scores are turned into a
+    distribution with a softmax, so the top probability works as confidence.
+    Thread-safe; learn() is incremental.
+    """
+
+    def __init__(self, k1=1.2, b=0.5, temperature=1.0):
+        self.k1 = k1
+        self.b = b
+        self.temperature = temperature
+        self.counts = defaultdict(Counter)   # chapter → term → weight
+        self.totals = Counter()               # chapter → sum of weights
+        self.df = Counter()                   # term → number of chapters containing it
+        self.examples = 0
+        self._lock = threading.Lock()
+
+    # ── Training ──
+    def _add(self, chapter, term, weight):
+        counts = self.counts[chapter]
+        if term not in counts:
+            self.df[term] += 1
+        counts[term] += weight
+        self.totals[chapter] += weight
+
+    def add(self, chapter, terms, weight=1.0):
+        with self._lock:
+            for term in terms:
+                self._add(chapter, term, weight)
+
+    def train_corpus(self, corpus):
+        """Section frequencies from the corpus indexes (Anmerkungen and Erläuterungen)."""
+        for number, chapter in corpus.chapters.items():
+            for index in chapter.indexes.values():
+                with self._lock:
+                    for term, postings in index.postings.items():
+                        if len(term) >= MIN_TERM_LEN and not term.isdigit():
+                            self._add(number, term, len(postings))
+        return self
+
+    def train_keywords(self, table):
+        for chapter, keywords in table.items():
+            self.add(chapter, [normalize(k) for k in keywords], KEYWORD_WEIGHT)
+        return self
+
+    def learn(self, text, chapter):
+        """Add one past classification (product text → chapter)."""
+        try:
+            chapter = int(chapter)
+        except (TypeError, ValueError):
+            return
+        if not 1 <= chapter <= 97:
+            return
+        self.add(chapter, set(self.terms(text)), EXAMPLE_WEIGHT)
+        with self._lock:
+            self.examples += 1
+
+    # ── Prediction ──
+    @staticmethod
+    def terms(text):
+        return [t for t in tokenize(text) if len(t) >= MIN_TERM_LEN and not t.isdigit()]
+
+    def expand(self, term):
+        """Known terms for a query term: exact, inflection stripped, or compound parts.
+
+        "akkuschrauber" → "akku" (modifier), "haselnuesse" → "nuess" (head),
+        "baumwoll" → "baumwolle"; only O(len) set lookups, no vocabulary scan.
+        """
+        known = self.df
+        if term in known:
+            return {term: 1.0}
+        forms = [term] + [term[:-len(e)] for e in INFLECTIONS if term.endswith(e) and len(term) - len(e) >= MIN_TERM_LEN]
+        for form in forms:
+            if form in known:
+                return {form: 1.0}
+            for ending in INFLECTIONS:
+                if form + ending in known:
+                    return {form + ending: 1.0}
+        parts = {}
+        for form in forms:
+            for i in range(1, len(form) - MIN_PART_LEN + 1):   # Kopf des Kompositums (längster zuerst)
+                if form[i:] in known:
+                    parts.setdefault(form[i:], PART_WEIGHT)
+                    break
+            for j in range(len(form) - 1, MIN_PART_LEN - 1, -1):   # Bestimmungswort
+                if form[:j] in known:
+                    parts.setdefault(form[:j], PART_WEIGHT * 0.5)
+                    break
+        return parts
+
+    def scores(self, text):
+        weighted = {}
+        for term in self.terms(text):
+            for vocab, weight in self.expand(term).items():
+                weighted[vocab] = max(weighted.get(vocab, 0.0), weight)
+        scores = defaultdict(float)
+        with self._lock:
+            size = len(self.counts)
+            if not size:
+                return scores
+            avg_total = sum(self.totals.values()) / size
+            for term, weight in weighted.items():
+                df = self.df.get(term, 0)
+                idf = math.log(1 + (size - df + 0.5) / (df + 0.5))
+                for chapter, counts in self.counts.items():
+                    tf = counts.get(term)
+                    if tf:
+                        norm = 1 - self.b + self.b * self.totals[chapter] / avg_total
+                        scores[chapter] += weight * idf * tf * (self.k1 + 1) / (tf + self.k1 * norm)
+        return scores
+
+    def predict(self, text, top=3):
+        """Ranked [(chapter, probability)] for a product text, best first; [] without known terms."""
+        scores = self.scores(text)
+        if not scores:
+            return []
+        best = max(scores.values())
+        # Kapitel ohne Treffer zählen mit Score 0 mit – sonst wäre ein einzelner Treffer immer "sicher"
+        missing = len(self.counts) - len(scores)
+        exp = {chapter: math.exp((score - best) / self.temperature) for chapter, score in scores.items()}
+        total = sum(exp.values()) + missing * math.exp(-best / self.temperature)
+        ranked = sorted(exp.items(), key=lambda item: (-item[1], item[0]))[:top]
+        return [(chapter, round(value / total, 4)) for chapter, value in ranked]
+
+    def stats(self):
+        return {"chapters": len(self.counts), "vocabulary": len(self.df), "examples": self.examples}
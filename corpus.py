@@ -0,0 +1,385 @@
+#!/usr/bin/env python3
+"""
+BAZG-Korpus – lädt alle Erläuterungen und Anmerkungen aus bazg_cache/ einmal
+beim Start und hält sie, in Abschnitte zerlegt, im Speicher.
+
+Alternativ als vorkompiliertes Bundle (Texte, Abschnitts-Offsets, Positionen und
+Suchindex in einer Datei), damit die Worker beim Start nichts zerlegen und
+indexieren müssen:
+
+    python corpus.py                      # bazg_cache/ → bazg_corpus.bundle
+    python corpus.py -o /data/bazg_corpus.bundle --force
+"""
+import argparse, hashlib, json, mmap, os, re, struct, threading, time
+from retrieval import SectionIndex, normalize, query_terms
+
+HEADER_RE = re.compile(r'^\s*(\d{4})')
+
+DOC_KINDS = {"erl": "erlaeuterungen", "anm": "anmerkungen"}
+
+# Bundle: MAGIC, Header-Länge (8 Byte), JSON-Header, danach alle Texte als UTF-8
+BUNDLE_MAGIC = b"BAZGCORP"
+BUNDLE_FORMAT = 2   # 2: Länge der Texte im Header (unvollständige Kopien erkennen)
+
+
+class Section:
+    """One section of a BAZG document, starting at a position number or an uppercase header."""
+    __slots__ = ("header", "position", "text", "text_lower")
+
+    def __init__(self, header, text, position=None):
+        self.header = header
+        self.position = position
+        self.text = text
+        self.text_lower = text.lower()
+
+    def __repr__(self):
+        return f"Section({self.position or self.header[:30]!r}, {len(self.text)} chars)"
+
+
+def split_sections(full_text):
+    """Split a document into sections (same header rules as the original line scanner)."""
+    sections = []
+    current_lines = []
+    current_header = ''
+    current_position = None
+    for line in full_text.split('\n'):
+        m = HEADER_RE.match(line)
+        stripped = line.strip()
+        is_header = bool(m) or (len(stripped) > 5 and stripped.isupper())
+        if is_header and current_lines:
+            sections.append(Section(current_header, '\n'.join(current_lines), current_position))
+            current_lines = [line]
+            current_header = stripped
+            current_position = m.group(1) if m else None
+        else:
+            current_lines.append(line)
+    if current_lines:
+        sections.append(Section(current_header, '\n'.join(current_lines), current_position))
+    return sections
+
+
+class MappedSection(Section):
+    """Section whose text stays in the memory-mapped bundle until it is read."""
+    __slots__ = ("_buffer", "_start", "_end")
+
+    def __init__(self, header, position, buffer, start, end):
+        self.header = header
+        self.position = position
+        self._buffer = buffer
+        self._start = start
+        self._end = end
+
+    @property
+    def text(self):
+        return str(self._buffer[self._start:self._end], 'utf-8')
+
+    @property
+    def text_lower(self):
+        return self.text.lower()
+
+
+class MappedText:
+    """A document in the bundle; str() decodes it."""
+    __slots__ = ("_buffer", "_start", "_end")
+
+    def __init__(self, buffer, start, end):
+        self._buffer = buffer
+        self._start = start
+        self._end = end
+
+    def __str__(self):
+        return str(self._buffer[self._start:self._end], 'utf-8')
+
+
+class Chapter:
+    """Texts and parsed sections of one tariff chapter."""
+    __slots__ = ("number", "texts", "sections", "indexes")
+
+    def __init__(self, number):
+        self.number = number
+        self.texts = {}
+        self.sections = {}
+        self.indexes = {}
+
+
+def read_documents(cache_dir):
+    """(number, kind, text) of all erl_/anm_ files, plus the content hash used as corpus version."""
+    documents = []
+    digest = hashlib.sha256()
+    for filename in sorted(os.listdir(cache_dir)):
+        m = re.match(r'^(erl|anm)_(\d+)\.txt$', filename)
+        if not m:
+            continue
+        with open(os.path.join(cache_dir, filename), 'r', encoding='utf-8') as f:
+            text = f.read()
+        digest.update(filename.encode() + b'\0' + text.encode('utf-8'))
+        documents.append((int(m.group(2)), DOC_KINDS[m.group(1)], text))
+    return documents, digest.hexdigest()[:12]
+
+
+class CorpusStore:
+    """All chapters of the BAZG cache, loaded once and addressed by chapter number.
+
+    load() parses the text files; load_bundle() reads a compiled bundle
+    instead: the postings come ready-made from its header (parsed by every
+    worker), the texts are mapped and decoded only when read.
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self.chapters = {}
+        self.version = None
+        self.source = None
+        self._buffer = None
+
+    def load(self):
+        chapters = {}
+        documents, version = read_documents(self.cache_dir)
+        for number, kind, text in documents:
+            chapter = chapters.setdefault(number, Chapter(number))
+            chapter.texts[kind] = text
+            chapter.sections[kind] = split_sections(text)
+            chapter.indexes[kind] = SectionIndex(chapter.sections[kind])
+        self.chapters = chapters
+        self.version = version
+        self.source = self.cache_dir
+        return self
+
+    def load_bundle(self, path):
+        """Map a bundle written by build_bundle(); raises ValueError if it is not one."""
+        with open(path, 'rb') as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        prefix = len(BUNDLE_MAGIC) + 8
+        if len(buffer) < prefix or buffer[:len(BUNDLE_MAGIC)] != BUNDLE_MAGIC:
+            raise ValueError(f"Kein Korpus-Bundle: {path}")
+        (size,) = struct.unpack_from(">Q", buffer, len(BUNDLE_MAGIC))
+        header = json.loads(buffer[prefix:prefix + size])
+        if header.get("format") != BUNDLE_FORMAT:
+            raise ValueError(f"Unbekanntes Bundle-Format {header.get('format')}: {path}")
+        base = prefix + size
+        if len(buffer) != base + header.get("blob_length", -1):
+            raise ValueError(f"Unvollständiges Korpus-Bundle ({len(buffer)} Bytes): {path}")
+        chapters = {}
+        try:
+            for doc in header["documents"]:
+                chapter = chapters.setdefault(doc["chapter"], Chapter(doc["chapter"]))
+                kind, start = doc["kind"], base + doc["offset"]
+                chapter.texts[kind] = MappedText(buffer, start, start + doc["length"])
+                chapter.sections[kind] = [MappedSection(header_text, position, buffer, start + begin, start + end)
+                                          for begin, end, position, header_text in doc["sections"]]
+                postings = {term: dict(zip(flat[::2], flat[1::2])) for term, flat in doc["postings"].items()}
+                chapter.indexes[kind] = SectionIndex.from_postings(postings, doc["lengths"])
+        except (KeyError, TypeError) as e:
+            raise ValueError(f"Ungültiger Bundle-Header ({type(e).__name__}: {e}): {path}") from None
+        self.chapters = chapters
+        self.version = header["version"]
+        self.source = path
+        self._buffer = buffer
+        return self
+
+    def chapter(self, chapter_num):
+        try:
+            return self.chapters.get(int(chapter_num))
+        except (TypeError, ValueError):
+            return None
+
+    def docs(self, chapter_num):
+        chapter = self.chapter(chapter_num)
+        return {kind: str(text) for kind, text in chapter.texts.items()} if chapter else {}
+
+    def sections(self, chapter_num, kind):
+        chapter = self.chapter(chapter_num)
+        return chapter.sections.get(kind, []) if chapter else []
+
+    def index(self, chapter_num, kind):
+        chapter = self.chapter(chapter_num)
+        return chapter.indexes.get(kind) if chapter else None
+
+    def relevant_text(self, chapter_num, kind, product_keywords, budget=None):
+        return select_relevant_sections(self.sections(chapter_num, kind), product_keywords,
+                                        budget=budget, index=self.index(chapter_num, kind))
+
+    def stats(self):
+        return {"version": self.version, "source": self.source, "chapters": len(self.chapters),
+                "mapped": self._buffer is not None}
+
+
+def open_corpus(cache_dir, bundle_path=None):
+    """Corpus from the bundle if there is a valid one, otherwise from the text files."""
+    if bundle_path and os.path.exists(bundle_path):
+        try:
+            return CorpusStore(cache_dir).load_bundle(bundle_path)
+        except (OSError, ValueError):
+            pass   # kaputtes/fremdes Bundle – die Textdateien gehen immer
+    return CorpusStore(cache_dir).load()
+
+
+# ── Bundle ──
+def bundle_version(path):
+    """Corpus version stored in a bundle, or None if there is no complete bundle of the current format."""
+    try:
+        with open(path, 'rb') as f:
+            if f.read(len(BUNDLE_MAGIC)) != BUNDLE_MAGIC:
+                return None
+            (size,) = struct.unpack(">Q", f.read(8))
+            header = json.loads(f.read(size))
+            complete = os.fstat(f.fileno()).st_size == len(BUNDLE_MAGIC) + 8 + size + header.get("blob_length", -1)
+            return header.get("version") if header.get("format") == BUNDLE_FORMAT and complete else None
+    except (OSError, ValueError, struct.error):
+        return None
+
+
+def build_bundle(cache_dir, path, force=False):
+    """Compile bazg_cache/ into a bundle at path (written next to it, then swapped in atomically).
+
+    Skips the build when the bundle already has the current content hash,
+    unless force is set. Returns {"version", "documents", "bytes", "built"}.
+    """
+    documents, version = read_documents(cache_dir)
+    if not force and bundle_version(path) == version:
+        return {"version": version, "documents": len(documents), "bytes": os.path.getsize(path), "built": False}
+    entries = []
+    blob = bytearray()
+    for number, kind, text in documents:
+        sections = split_sections(text)
+        index = SectionIndex(sections)
+        offset = len(blob)
+        spans = []
+        position = 0
+        for section in sections:   # Abschnitte sind durch genau ein '\n' getrennt
+            size = len(section.text.encode('utf-8'))
+            spans.append([position, position + size, section.position, section.header])
+            position += size + 1
+        data = text.encode('utf-8')
+        blob += data
+        entries.append({
+            "chapter": number, "kind": kind, "offset": offset, "length": len(data), "sections": spans,
+            "lengths": index.lengths,
+            "postings": {term: [v for item in sorted(postings.items()) for v in item]
+                         for term, postings in index.postings.items()},
+        })
+    header = json.dumps({"format": BUNDLE_FORMAT, "version": version, "built_at": time.time(),
+                         "blob_length": len(blob), "documents": entries}, ensure_ascii=False, separators=(",", ":")).encode('utf-8')
+    tmp = f"{path}.tmp"
+    with open(tmp, 'wb') as f:
+        f.write(BUNDLE_MAGIC + struct.pack(">Q", len(header)))
+        f.write(header)
+        f.write(blob)
+    os.replace(tmp, path)   # nie in-place schreiben: laufende Worker haben die alte Datei gemappt
+    return {"version": version, "documents": len(documents), "bytes": os.path.getsize(path), "built": True}
+
+
+class BundleWatcher:
+    """Polls a bundle path and calls on_change(path) once it has been replaced.
+
+    Runs in a daemon thread per process (start() after the gunicorn fork).
+    A failing on_change (half-copied file, wrong format, any error while
+    rebuilding) is retried at the next poll; the error is kept for stats().
+    """
+
+    def __init__(self, path, interval, on_change):
+        self.path = path
+        self.interval = interval
+        self.on_change = on_change
+        self.stamp = self._stamp()   # vor dem ersten Laden nehmen, sonst geht ein Austausch verloren
+        self.reloads = 0
+        self.error = None
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def _stamp(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def check(self):
+        """Reload if the file changed since the last successful load; True if it did."""
+        stamp = self._stamp()
+        if stamp is None or stamp == self.stamp:
+            return False
+        try:
+            self.on_change(self.path)
+        except Exception as e:   # der Watcher-Thread darf nie sterben, sonst gibt es keinen Reload mehr
+            self.error = f"{type(e).__name__}: {e}"
+            return False
+        self.stamp = stamp
+        self.reloads += 1
+        self.error = None
+        return True
+
+    def start(self):
+        if not self.path or self.interval <= 0:
+            return
+        with self._lock:
+            if self._thread is not None and self._thread[0] == os.getpid():
+                return
+
+            def loop():
+                while True:
+                    time.sleep(self.interval)
+                    try:
+                        self.check()
+                    except Exception as e:
+                        self.error = f"{type(e).__name__}: {e}"
+
+            thread = threading.Thread(target=loop, name="corpus-watch", daemon=True)
+            self._thread = (os.getpid(), thread)
+            thread.start()
+
+    def stats(self):
+        return {"path": self.path, "interval": self.interval, "reloads": self.reloads, "error": self.error}
+
+
+# Abschnitte mit diesen Begriffen (Mindestgehalte, Ausnahmen) erhalten einen Bonus
+PRIORITY_TERMS = {'mindestgehalt', 'quotient', 'fruchtsaft', 'fruchtmark', 'gemüsesaft',
+                  'anmerkung', 'ausgenommen', 'einschliesslich'}
+PRIORITY_BOOSTS = {normalize(term): 0.3 for term in PRIORITY_TERMS}
+INTRO_CHARS = 4000
+
+
+def select_relevant_sections(sections, product_keywords, budget=None, index=None, cost=len):
+    """Introduction plus the best-ranked sections (BM25) that fit into budget.
+
+    budget is measured with cost (characters by default, or e.g. a token
+    estimate). Sections are picked by rank but emitted in document order,
+    so the legal structure of the text stays readable.
+    """
+    if not sections:
+        return ''
+    if index is None:
+        index = SectionIndex(sections)
+    intro = sections[0].text[:INTRO_CHARS]
+    if budget is not None:
+        while intro and cost(intro) > budget:
+            intro = intro[:intro.rfind('\n')] if '\n' in intro else ''
+        budget -= cost(intro)
+
+    chosen = []
+    for idx in index.rank(query_terms(product_keywords), PRIORITY_BOOSTS):
+        if idx == 0:
+            continue
+        size = cost(sections[idx].text) + 2
+        if budget is not None:
+            if size > budget:
+                continue
+            budget -= size
+        chosen.append(idx)
+
+    return '\n\n'.join([intro] + [sections[idx].text for idx in sorted(chosen)])
+
+
+def main():
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cache-dir", default=os.path.join(base_dir, "bazg_cache"))
+    parser.add_argument("-o", "--output", default=os.path.join(base_dir, "bazg_corpus.bundle"))
+    parser.add_argument("--force", action="store_true", help="auch bauen, wenn die Version schon stimmt")
+    args = parser.parse_args()
+    stats = build_bundle(args.cache_dir, args.output, args.force)
+    print(json.dumps(dict(stats, output=args.output)))
+
+
+if __name__ == '__main__':
+    main()
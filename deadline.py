@@ -0,0 +1,57 @@
+"""
+Zeitbudget pro Request – eine Deadline, die durch die ganze Pipeline
+mitläuft (auch in die Lookup-Threads), damit jede Stufe nur noch die
+Restzeit bekommt und optionale Stufen bei knappem Budget entfallen.
+"""
+import contextvars, time
+
+CURRENT = contextvars.ContextVar("deadline", default=None)
+
+
+class DeadlineExceeded(TimeoutError):
+    """The request's time budget ran out before or during a stage."""
+
+
+class Deadline:
+    __slots__ = ("budget", "expires_at", "skipped")
+
+    def __init__(self, seconds):
+        self.budget = seconds
+        self.expires_at = time.monotonic() + seconds
+        self.skipped = []
+
+    def remaining(self):
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def allows(self, seconds):
+        return self.remaining() >= seconds
+
+    def skip(self, stage):
+        if stage not in self.skipped:
+            self.skipped.append(stage)
+
+
+def current():
+    return CURRENT.get()
+
+
+def stage_timeout(default):
+    """The stage's own timeout, capped by the current request deadline (if any).
+
+    Raises DeadlineExceeded when (almost) nothing is left, so no request is
+    sent that cannot complete anyway.
+    """
+    deadline = CURRENT.get()
+    if deadline is None:
+        return default
+    remaining = deadline.remaining()
+    if remaining < 0.05:
+        raise DeadlineExceeded("Zeitbudget des Requests aufgebraucht")
+    return min(default, remaining)
+
+
+def stage_deadline(default):
+    """Monotonic deadline for a stage: now + default, but not past the request deadline."""
+    deadline = CURRENT.get()
+    at = time.monotonic() + default
+    return min(at, deadline.expires_at) if deadline else at
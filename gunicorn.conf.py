@@ -0,0 +1,25 @@
+"""
+gunicorn-Konfiguration – I/O-nebenläufiger Betrieb mit gthread-Workern.
+
+Jeder Request verbringt fast seine ganze Zeit mit Warten auf Groq und Open
+Food Facts. Mit Threads pro Worker bedient ein Prozess viele Requests
+gleichzeitig, statt für jeden Upstream-Call blockiert zu sein. Die Pipeline
+(Caches, HTTP-Pool, Korpus) ist dafür thread-sicher.
+"""
+import multiprocessing, os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '10000')}"
+
+# Prozesse: CPU-Arbeit (Abschnittssuche, JSON) ist gering – wenige Worker reichen
+workers = int(os.environ.get("WEB_CONCURRENCY", min(4, multiprocessing.cpu_count() * 2)))
+os.environ["WEB_CONCURRENCY"] = str(workers)   # die Worker erben es: app.py teilt die Groq-Limits dadurch
+# Threads pro Worker = gleichzeitige Requests pro Prozess (Upstream-Wartezeit)
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "gthread")
+threads = int(os.environ.get("GUNICORN_THREADS", "16"))
+
+# Eine Klassifizierung kann inkl. Web-Suche und zwei LLM-Calls ~45 s dauern
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", "60"))
+graceful_timeout = int(os.environ.get("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+keepalive = int(os.environ.get("GUNICORN_KEEPALIVE", "5"))
+
+accesslog = "-"
@@ -0,0 +1,240 @@
+"""
+HTTP-Transport – gemeinsamer Client mit Keep-Alive-Verbindungspools pro Host
+für Groq und Open Food Facts (statt neuer TCP/TLS-Verbindung pro Aufruf).
+"""
+import http.client, json, socket, ssl, threading, time
+from urllib.parse import urlsplit
+
+
+class HTTPError(Exception):
+    """Non-2xx response from an upstream."""
+
+    def __init__(self, status, body=b"", headers=None, url=""):
+        super().__init__(f"HTTP {status} von {url}")
+        self.status = status
+        self.code = status   # wie urllib.error.HTTPError
+        self.body = body
+        self.headers = headers or {}
+        self.url = url
+
+
+class HTTPResponse:
+    __slots__ = ("status", "headers", "body")
+
+    def __init__(self, status, headers, body):
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+    def json(self):
+        return json.loads(self.body.decode("utf-8"))
+
+
+class StreamResponse:
+    """Streamed 2xx response; iterate lines() to read the body line by line."""
+
+    def __init__(self, client, key, conn, sock, response, headers):
+        self.status = response.status
+        self.headers = headers
+        self._client = client
+        self._key = key
+        self._conn = conn
+        self._sock = sock   # conn.sock ist None, wenn die Antwort die Verbindung schliesst
+        self._response = response
+
+    def settimeout(self, seconds):
+        """Timeout for the following reads (e.g. the time left until a deadline)."""
+        self._sock.settimeout(seconds)
+
+    def lines(self):
+        """Yield body lines (bytes, without newline); the connection goes back to the pool at EOF."""
+        completed = False
+        try:
+            for line in self._response:
+                yield line.rstrip(b"\r\n")
+            completed = True
+        finally:
+            if completed:
+                self._client._finish(self._key, self._conn, self._response)
+            else:
+                self._response.close()   # Abbruch mitten im Stream – Verbindung nicht wiederverwenden
+                self._conn.close()
+
+
+def _failure(error):
+    return "timeout" if isinstance(error, (socket.timeout, TimeoutError)) else "error"
+
+
+# Fehler, bei denen eine wiederverwendete Verbindung vom Server schon geschlossen war
+STALE_ERRORS = (http.client.RemoteDisconnected, http.client.BadStatusLine,
+                ConnectionResetError, BrokenPipeError, ConnectionAbortedError)
+
+
+class HTTPClient:
+    """HTTP/1.1 client with a keep-alive connection pool per (scheme, host, port).
+
+    connect_timeout bounds the TCP/TLS setup, the per-call timeout (or
+    read_timeout) bounds every read. Connections are returned to the pool
+    after the response body has been read completely. observer(host, status,
+    seconds) is called per request with the HTTP status, "timeout" or "error".
+    """
+
+    def __init__(self, user_agent, connect_timeout=5.0, read_timeout=25.0, max_idle_per_host=8,
+                 default_headers=None, observer=None):
+        self.observer = observer
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_idle_per_host = max_idle_per_host
+        self.headers = {"User-Agent": user_agent, "Accept-Encoding": "identity", "Connection": "keep-alive"}
+        self.headers.update(default_headers or {})
+        self._ssl_context = ssl.create_default_context()
+        self._idle = {}       # (scheme, host, port) → [HTTPConnection]
+        self._lock = threading.Lock()
+        self._stats = {"requests": 0, "connections_opened": 0, "connections_reused": 0,
+                       "stale_retries": 0, "errors": 0}
+        self._host_stats = {}
+
+    # ── Pool ──
+    def _key(self, url):
+        parts = urlsplit(url)
+        port = parts.port or (443 if parts.scheme == "https" else 80)
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+        return (parts.scheme, parts.hostname, port), path
+
+    def _count(self, name, host=None):
+        with self._lock:
+            self._stats[name] += 1
+            if host is not None:
+                per_host = self._host_stats.setdefault(host, {"requests": 0, "connections_opened": 0,
+                                                              "connections_reused": 0})
+                if name in per_host:
+                    per_host[name] += 1
+
+    def _acquire(self, key):
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                return idle.pop(), True
+        scheme, host, port = key
+        if scheme == "https":
+            conn = http.client.HTTPSConnection(host, port, timeout=self.connect_timeout, context=self._ssl_context)
+        else:
+            conn = http.client.HTTPConnection(host, port, timeout=self.connect_timeout)
+        conn.connect()
+        self._count("connections_opened", f"{host}:{port}")
+        return conn, False
+
+    def _release(self, key, conn):
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.max_idle_per_host:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def close(self):
+        with self._lock:
+            pools, self._idle = self._idle, {}
+        for idle in pools.values():
+            for conn in idle:
+                conn.close()
+
+    # ── Requests ──
+    def _observe(self, url, status, start):
+        if self.observer is not None:
+            self.observer(urlsplit(url).hostname, status, time.monotonic() - start)
+
+    def request(self, method, url, body=None, headers=None, timeout=None):
+        """Send a request and return the fully read HTTPResponse; raises HTTPError on non-2xx."""
+        start = time.monotonic()
+        try:
+            response, conn, key, _ = self._send(method, url, body, headers, timeout)
+            try:
+                data = response.read()
+            except Exception:
+                conn.close()
+                raise
+        except Exception as e:
+            self._observe(url, _failure(e), start)
+            raise
+        self._finish(key, conn, response)
+        self._observe(url, response.status, start)
+        result = HTTPResponse(response.status, {k.lower(): v for k, v in response.getheaders()}, data)
+        if not 200 <= response.status < 300:
+            raise HTTPError(response.status, data, result.headers, url)
+        return result
+
+    def stream(self, method, url, body=None, headers=None, timeout=None):
+        """Send a request and return a StreamResponse once the status line and headers are in.
+
+        Raises HTTPError on non-2xx, so callers can retry before consuming the body.
+        The observer sees the time to the response headers.
+        """
+        start = time.monotonic()
+        try:
+            response, conn, key, sock = self._send(method, url, body, headers, timeout)
+        except Exception as e:
+            self._observe(url, _failure(e), start)
+            raise
+        self._observe(url, response.status, start)
+        response_headers = {k.lower(): v for k, v in response.getheaders()}
+        if not 200 <= response.status < 300:
+            data = response.read()
+            self._finish(key, conn, response)
+            raise HTTPError(response.status, data, response_headers, url)
+        return StreamResponse(self, key, conn, sock, response, response_headers)
+
+    def _send(self, method, url, body, headers, timeout):
+        key, path = self._key(url)
+        host = f"{key[1]}:{key[2]}"
+        all_headers = dict(self.headers)
+        all_headers.update(headers or {})
+        self._count("requests", host)
+        for attempt in range(2):
+            try:
+                conn, reused = self._acquire(key)
+            except (OSError, http.client.HTTPException):
+                self._count("errors")
+                raise
+            if reused:
+                self._count("connections_reused", host)
+            try:
+                sock = conn.sock
+                sock.settimeout(self.read_timeout if timeout is None else timeout)
+                conn.request(method, path, body=body, headers=all_headers)
+                return conn.getresponse(), conn, key, sock
+            except STALE_ERRORS:
+                conn.close()
+                if reused and attempt == 0:
+                    self._count("stale_retries")
+                    continue
+                self._count("errors")
+                raise
+            except (OSError, http.client.HTTPException):
+                conn.close()
+                self._count("errors")
+                raise
+
+    def _finish(self, key, conn, response):
+        if response.will_close:
+            conn.close()
+        else:
+            self._release(key, conn)
+
+    def get_json(self, url, headers=None, timeout=None):
+        return self.request("GET", url, headers=headers, timeout=timeout).json()
+
+    def post_json(self, url, payload, headers=None, timeout=None):
+        all_headers = {"Content-Type": "application/json"}
+        all_headers.update(headers or {})
+        body = json.dumps(payload).encode("utf-8")
+        return self.request("POST", url, body=body, headers=all_headers, timeout=timeout)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["hosts"] = {host: dict(s) for host, s in self._host_stats.items()}
+            stats["idle_connections"] = sum(len(idle) for idle in self._idle.values())
+        return stats
@@ -0,0 +1,86 @@
+"""
+Keyword-Matcher – Aho-Corasick-Automat über eine Schlüsselwort-Tabelle
+(z.B. CHAPTER_KEYWORDS), findet alle Treffer in einem Durchlauf.
+"""
+from collections import deque
+
+
+class KeywordMatcher:
+    """Compiled multi-pattern matcher for a {label: [keyword | (keyword, weight)]} table.
+
+    Matching is substring-based like `kw in text`, overlapping hits included
+    ("mineralöl" also yields "mineral" and "öl"). Each keyword counts once
+    per text, no matter how often it occurs.
+    """
+
+    def __init__(self, table):
+        self.labels = {}       # keyword → [(label, weight)]
+        for label, keywords in table.items():
+            for entry in keywords:
+                keyword, weight = entry if isinstance(entry, tuple) else (entry, 1)
+                self.labels.setdefault(keyword.lower(), []).append((label, weight))
+        self._build(self.labels)
+
+    def _build(self, keywords):
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]
+        for keyword in keywords:
+            state = 0
+            for char in keyword:
+                nxt = self.goto[state].get(char)
+                if nxt is None:
+                    nxt = len(self.goto)
+                    self.goto[state][char] = nxt
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append([])
+                state = nxt
+            self.output[state].append(keyword)
+
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, nxt in self.goto[state].items():
+                queue.append(nxt)
+                f = self.fail[state]
+                while f and char not in self.goto[f]:
+                    f = self.fail[f]
+                self.fail[nxt] = self.goto[f].get(char, 0)
+                self.output[nxt] = self.output[nxt] + self.output[self.fail[nxt]]
+
+    def find(self, text):
+        """All (start_position, keyword) hits in text, in text order."""
+        hits = []
+        state = 0
+        goto, fail, output = self.goto, self.fail, self.output
+        for pos, char in enumerate(text.lower()):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for keyword in output[state]:
+                hits.append((pos - len(keyword) + 1, keyword))
+        return hits
+
+    def match(self, text):
+        """Scores per label plus the evidence behind them.
+
+        Returns {"scores": {label: score}, "hits": {label: [{"keyword", "position", "weight"}]},
+        "best": [labels with the top score], "tie": bool}.
+        """
+        first_seen = {}
+        for position, keyword in self.find(text):
+            first_seen.setdefault(keyword, position)
+
+        scores = {}
+        hits = {}
+        for keyword, position in sorted(first_seen.items(), key=lambda kv: kv[1]):
+            for label, weight in self.labels[keyword]:
+                scores[label] = scores.get(label, 0) + weight
+                hits.setdefault(label, []).append({"keyword": keyword, "position": position, "weight": weight})
+
+        best = []
+        if scores:
+            max_score = max(scores.values())
+            best = sorted(label for label, score in scores.items() if score == max_score)
+        return {"scores": scores, "hits": hits, "best": best, "tie": len(best) > 1}
@@ -0,0 +1,219 @@
+"""
+Metriken – Zähler und Histogramme im Prometheus-Textformat (ohne
+prometheus_client), Zeitmessung pro Pipeline-Stufe und optional pro Request.
+Mit METRICS_DIR schreibt jeder gunicorn-Worker seinen Stand regelmässig in eine
+Datei; /metrics summiert dann über alle Worker.
+"""
+import contextvars, json, os, threading, time
+from contextlib import contextmanager
+
+# Sekunden-Buckets: von Cache-Treffern (ms) bis zu langen LLM-Aufrufen
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 60)
+TOKEN_BUCKETS = (500, 1000, 2000, 4000, 6000, 8000, 12000, 16000, 24000, 32000)
+
+# Pro Request gesammelte Zeiten (nur mit debug); wandert über copy_context() in Pool-Threads mit
+TIMINGS = contextvars.ContextVar("timings", default=None)
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(label, "")) for label in self.labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dump(self):
+        with self._lock:
+            return [[list(key), value] for key, value in self.values.items()]
+
+    def merge(self, values, dumped):
+        for key, value in dumped:
+            key = tuple(key)
+            values[key] = values.get(key, 0) + value
+
+    def render(self, values):
+        for key, value in sorted(values.items()):
+            yield f"{self.name}{_labels(self.labels, key)} {_number(value)}"
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self.values = {}   # label values → [counts per bucket..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(label, "")) for label in self.labels)
+        with self._lock:
+            series = self.values.get(key)
+            if series is None:
+                series = self.values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += 1
+            series[-1] += value
+
+    def dump(self):
+        with self._lock:
+            return [[list(key), list(series)] for key, series in self.values.items()]
+
+    def merge(self, values, dumped):
+        for key, series in dumped:
+            key = tuple(key)
+            if key in values:
+                values[key] = [a + b for a, b in zip(values[key], series)]
+            else:
+                values[key] = list(series)
+
+    def render(self, values):
+        for key, series in sorted(values.items()):
+            for bound, count in zip(self.buckets, series):
+                yield f"{self.name}_bucket{_labels(self.labels + ('le',), key + (_number(bound),))} {count}"
+            yield f"{self.name}_bucket{_labels(self.labels + ('le',), key + ('+Inf',))} {series[-2]}"
+            yield f"{self.name}_count{_labels(self.labels, key)} {series[-2]}"
+            yield f"{self.name}_sum{_labels(self.labels, key)} {_number(series[-1])}"
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values))
+    return "{" + pairs + "}"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Registry:
+    """Holds all metrics of this process; optionally shares them across workers via `directory`."""
+
+    def __init__(self, directory=None, flush_interval=5.0):
+        self.metrics = []
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self._flusher = None
+        self._lock = threading.Lock()
+
+    def counter(self, name, help, labels=()):
+        return self._add(Counter(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        return self._add(Histogram(name, help, labels, buckets))
+
+    def _add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    # ── Worker-übergreifend ──
+    def _path(self, pid=None):
+        return os.path.join(self.directory, f"metrics-{pid or os.getpid()}.json")
+
+    def flush(self):
+        """Write this process's metrics to its file (atomically)."""
+        if not self.directory:
+            return
+        data = {m.name: m.dump() for m in self.metrics}
+        path = self._path()
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp, path)
+
+    def start(self):
+        """Start the background flusher (once per process, i.e. after the gunicorn fork)."""
+        if not self.directory:
+            return
+        with self._lock:
+            if self._flusher is not None and self._flusher[0] == os.getpid():
+                return
+            os.makedirs(self.directory, exist_ok=True)
+
+            def loop():
+                while True:
+                    time.sleep(self.flush_interval)
+                    try:
+                        self.flush()
+                    except OSError:
+                        pass
+
+            thread = threading.Thread(target=loop, name="metrics-flush", daemon=True)
+            self._flusher = (os.getpid(), thread)
+            thread.start()
+
+    def _collect(self):
+        merged = {m.name: {} for m in self.metrics}
+        own = self._path() if self.directory else None
+        if self.directory and os.path.isdir(self.directory):
+            for name in os.listdir(self.directory):
+                path = os.path.join(self.directory, name)
+                if not name.endswith(".json") or path == own:
+                    continue
+                try:
+                    with open(path, encoding="utf-8") as f:
+                        data = json.load(f)
+                except (OSError, ValueError):
+                    continue
+                for metric in self.metrics:
+                    metric.merge(merged[metric.name], data.get(metric.name, []))
+        for metric in self.metrics:   # eigener Prozess immer live statt aus der Datei
+            metric.merge(merged[metric.name], metric.dump())
+        return merged
+
+    def render(self):
+        """Prometheus text exposition format (version 0.0.4)."""
+        merged = self._collect()
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render(merged[metric.name]))
+        return "\n".join(lines) + "\n"
+
+
+# ── Spans ──
+def record(stage, seconds, histogram):
+    """Record a stage duration in `histogram` and, if collecting, in the request's timings."""
+    histogram.observe(seconds, stage=stage)
+    timings = TIMINGS.get()
+    if timings is not None:
+        timings.setdefault(stage, []).append(round(seconds * 1000, 1))
+
+
+@contextmanager
+def span(stage, histogram):
+    """Time the with-block as `stage` (also when it raises)."""
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        record(stage, time.monotonic() - start, histogram)
+
+
+@contextmanager
+def collect_timings():
+    """Collect the spans of this request (and its pool threads) into a dict: stage → [ms, ...]."""
+    timings = {}
+    token = TIMINGS.set(timings)
+    try:
+        yield timings
+    finally:
+        TIMINGS.reset(token)
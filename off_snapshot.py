@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""
+Lokaler Open-Food-Facts-Snapshot – Import des OFF-Bulk-Exports (JSONL oder CSV,
+auch .gz) in eine kompakte SQLite-Datei: Produkte nach EAN plus FTS5-Index über
+Name und Marke. Die App fragt ihn vor dem Netzwerk ab.
+
+    python off_snapshot.py openfoodfacts-products.jsonl.gz --country switzerland --lang de
+    python off_snapshot.py en.openfoodfacts.org.products.csv.gz -o off_snapshot.sqlite3
+"""
+import argparse, csv, gzip, io, json, os, re, sqlite3, sys, threading, time
+
+# Felder, die format_off_product() braucht (plus Code)
+FIELDS = ("product_name", "brands", "ingredients_text", "categories", "quantity")
+BATCH_SIZE = 5000
+
+
+def open_dump(path):
+    """Text stream of a (possibly gzipped) dump; '-' reads stdin."""
+    if path == "-":
+        return io.TextIOWrapper(sys.stdin.buffer, encoding="utf-8", errors="replace")
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8", errors="replace")
+    return open(path, encoding="utf-8", errors="replace")
+
+
+def read_jsonl(stream):
+    for line in stream:
+        if line.strip():
+            try:
+                yield json.loads(line)
+            except ValueError:
+                continue   # kaputte Zeilen kommen im Export vor
+
+
+def read_csv(stream):
+    csv.field_size_limit(sys.maxsize)
+    yield from csv.DictReader(stream, delimiter="\t", quoting=csv.QUOTE_NONE)
+
+
+def _tags(value):
+    if isinstance(value, list):
+        return value
+    return [tag.strip() for tag in (value or "").split(",") if tag.strip()]
+
+
+def slim(record, lang=None):
+    """Reduce an OFF record to code + FIELDS, preferring the `lang` variants (product_name_de, ...)."""
+    code = re.sub(r'\D', '', str(record.get("code") or record.get("_id") or ""))
+    if not code:
+        return None
+    product = {"code": code}
+    for field in FIELDS:
+        value = ""
+        if lang and field in ("product_name", "ingredients_text"):
+            value = record.get(f"{field}_{lang}") or ""
+        product[field] = str(value or record.get(field) or "").strip()
+    if not product["product_name"] and not product["ingredients_text"]:
+        return None   # nichts, was für die Tarifierung hilft
+    return product
+
+
+def wanted(record, country=None, lang=None):
+    """Filter by country (e.g. "switzerland" → en:switzerland in countries_tags) and language."""
+    if country and f"en:{country}" not in _tags(record.get("countries_tags")):
+        return False
+    if lang and record.get("lang") != lang and not record.get(f"product_name_{lang}"):
+        return False
+    return True
+
+
+def import_dump(source, target, country=None, lang=None, fmt=None, progress=None):
+    """Stream `source` into a fresh snapshot at `target` (built next to it, then swapped in).
+
+    Returns {"read", "imported", "seconds"}.
+    """
+    fmt = fmt or ("csv" if ".csv" in os.path.basename(source) else "jsonl")
+    start = time.monotonic()
+    tmp = f"{target}.tmp"
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    db = sqlite3.connect(tmp)
+    read = imported = 0
+    try:
+        db.execute("PRAGMA journal_mode=OFF")
+        db.execute("PRAGMA synchronous=OFF")
+        db.execute("CREATE TABLE products (code TEXT PRIMARY KEY, product_name TEXT, brands TEXT, "
+                   "ingredients_text TEXT, categories TEXT, quantity TEXT) WITHOUT ROWID")
+        batch = []
+        with open_dump(source) as stream:
+            records = read_csv(stream) if fmt == "csv" else read_jsonl(stream)
+            for record in records:
+                read += 1
+                if not wanted(record, country, lang):
+                    continue
+                product = slim(record, lang)
+                if product is None:
+                    continue
+                batch.append(tuple(product[k] for k in ("code",) + FIELDS))
+                if len(batch) >= BATCH_SIZE:
+                    imported += _insert(db, batch)
+                    batch = []
+                    if progress:
+                        progress(read, imported)
+        imported += _insert(db, batch)
+        db.execute("CREATE VIRTUAL TABLE names USING fts5(code UNINDEXED, product_name, brands, "
+                   "tokenize='unicode61 remove_diacritics 2')")
+        db.execute("INSERT INTO names (code, product_name, brands) SELECT code, product_name, brands FROM products")
+        db.execute("INSERT INTO names (names) VALUES ('optimize')")
+        db.commit()
+        db.execute("VACUUM")
+    finally:
+        db.close()
+    os.replace(tmp, target)
+    return {"read": read, "imported": imported, "seconds": round(time.monotonic() - start, 1)}
+
+
+def _insert(db, rows):
+    db.executemany("INSERT OR REPLACE INTO products VALUES (?, ?, ?, ?, ?, ?)", rows)
+    return len(rows)
+
+
+class OFFSnapshot:
+    """Read-only access to an imported snapshot; one SQLite connection per thread."""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def open(cls, path):
+        """Snapshot at path, or None when there is none (lookups then go to the network only)."""
+        if not path or not os.path.exists(path):
+            return None
+        return cls(path)
+
+    def _db(self):
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+            db.row_factory = sqlite3.Row
+            self._local.db = db
+        return db
+
+    def product(self, code):
+        """Raw OFF product dict (FIELDS + code) for a barcode, or None."""
+        try:
+            row = self._db().execute("SELECT * FROM products WHERE code = ?", (code,)).fetchone()
+        except sqlite3.Error:
+            return None
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return dict(row)
+
+    def search(self, query, limit=3):
+        """Best matching products for a name query (all terms must match), best first."""
+        terms = re.findall(r'\w+', query.lower())
+        if not terms:
+            return []
+        match = " ".join(f'"{term}"' for term in terms)
+        try:
+            rows = self._db().execute(
+                "SELECT p.* FROM names JOIN products p ON p.code = names.code "
+                "WHERE names MATCH ? ORDER BY bm25(names, 0, 2.0, 1.0) LIMIT ?", (match, limit)).fetchall()
+        except sqlite3.Error:
+            return []
+        return [dict(row) for row in rows]
+
+    def stats(self):
+        return {"path": self.path, "hits": self.hits, "misses": self.misses}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("dump", help="OFF-Export (.jsonl, .csv, optional .gz; '-' = stdin)")
+    parser.add_argument("-o", "--output", default=os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                               "off_snapshot.sqlite3"))
+    parser.add_argument("--format", choices=("jsonl", "csv"), help="Default: aus dem Dateinamen")
+    parser.add_argument("--country", help="nur Produkte mit en:<country> in countries_tags, z.B. switzerland")
+    parser.add_argument("--lang", help="nur Produkte dieser Sprache; bevorzugt product_name_<lang> usw.")
+    args = parser.parse_args()
+
+    def progress(read, imported):
+        print(f"\r{read} gelesen, {imported} importiert", end="", file=sys.stderr)
+
+    stats = import_dump(args.dump, args.output, args.country, args.lang, args.format, progress)
+    print(file=sys.stderr)
+    print(json.dumps(dict(stats, output=args.output)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""
+Parallele Datenbeschaffung – startet mehrere Lookups gleichzeitig und nimmt
+das beste Ergebnis nach Priorität ("first good result wins").
+"""
+import contextvars, threading
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FuturesTimeout
+
+_PENDING = object()
+
+
+def make_pool(max_workers, name):
+    return ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+
+
+def delayed(fn, delay, cancelled):
+    """Wrap fn so it only starts after delay seconds, unless cancelled is set first (hedging)."""
+    def run():
+        if delay > 0 and cancelled.wait(delay):
+            return None
+        if cancelled.is_set():
+            return None
+        return fn()
+    return run
+
+
+def first_by_priority(pool, tasks, timeout=None, cancelled=None):
+    """Run tasks (callables, highest priority first) concurrently on pool.
+
+    A truthy result is returned as soon as every higher-priority task has
+    finished empty-handed; exceptions count as empty. On timeout the best
+    result available so far wins. Losing tasks are cancelled: pending ones
+    never start, and `cancelled` is set so cooperative tasks can bail out.
+    Returns (index, result) or (None, None).
+    """
+    cancelled = cancelled or threading.Event()
+    # Kontext (z.B. Priorität) in die Pool-Threads mitnehmen
+    futures = [pool.submit(contextvars.copy_context().run, task) for task in tasks]
+    position = {future: i for i, future in enumerate(futures)}
+    results = [_PENDING] * len(futures)
+
+    def winner(final):
+        for i, result in enumerate(results):
+            if result is _PENDING:
+                if not final:
+                    return None
+                continue
+            if result:
+                return i
+        return None
+
+    try:
+        for future in as_completed(futures, timeout=timeout):
+            try:
+                results[position[future]] = future.result()
+            except Exception:
+                results[position[future]] = None
+            i = winner(final=False)
+            if i is not None:
+                return i, results[i]
+    except FuturesTimeout:
+        pass
+    finally:
+        cancelled.set()
+        for future in futures:
+            future.cancel()
+
+    i = winner(final=True)
+    return (i, results[i]) if i is not None else (None, None)
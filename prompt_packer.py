@@ -0,0 +1,102 @@
+"""
+Prompt-Packer – verteilt ein Token-Budget pro Request auf AV-Text,
+Anmerkungen und Erläuterungen, statt fix nach 24000 Zeichen abzuschneiden.
+"""
+import re
+from corpus import select_relevant_sections
+
+TOKEN_RE = re.compile(r'\w+|[^\w\s]|\s+')
+
+# Anteil des Restbudgets, den die Anmerkungen (rechtsverbindlich) mindestens bekommen
+ANM_SHARE = 0.4
+
+
+def estimate_tokens(text):
+    """Local token estimate for German text (Llama-3-style BPE), no tokenizer needed.
+
+    Words cost about one token per 3.5 characters, punctuation one token,
+    whitespace runs one token per 8 characters (layout indentation).
+    """
+    tokens = 0
+    for piece in TOKEN_RE.findall(text):
+        first = piece[0]
+        if first.isspace():
+            tokens += (len(piece) + 7) // 8
+        elif first.isalnum() or first == '_':
+            tokens += max(1, round(len(piece) / 3.5))
+        else:
+            tokens += 1
+    return tokens
+
+
+def compact(text):
+    """Drop layout whitespace that costs tokens but carries no content."""
+    text = re.sub(r'[ \t]+\n', '\n', text)
+    text = re.sub(r'\n{3,}', '\n\n', text)
+    return re.sub(r'(?<=\S)[ \t]{4,}', '   ', text)
+
+
+def trim_lines(text, budget):
+    """Longest prefix of whole lines that fits into budget tokens."""
+    lines = text.split('\n')
+    kept, used = [], 0
+    for line in lines:
+        cost = estimate_tokens(line) + 1
+        if used + cost > budget:
+            break
+        kept.append(line)
+        used += cost
+    return '\n'.join(kept)
+
+
+def pack_part(sections, keywords, index, budget):
+    """Whole document if it fits, else intro plus best-ranked sections within budget."""
+    if not sections or budget <= 0:
+        return "", 0
+    full = compact('\n'.join(s.text for s in sections))
+    tokens = estimate_tokens(full)
+    if tokens <= budget:
+        return full, tokens
+    text = select_relevant_sections(sections, keywords, budget=budget, index=index,
+                                    cost=lambda t: estimate_tokens(compact(t)))
+    text = compact(text)
+    tokens = estimate_tokens(text)
+    if tokens > budget:
+        text = trim_lines(text, budget)
+        tokens = estimate_tokens(text)
+    return text, tokens
+
+
+def pack_context(budget, fixed_text, av_text, anm, erl, keywords):
+    """Fit AV text, Anmerkungen and Erläuterungen into `budget` tokens.
+
+    fixed_text is everything that is always sent (prompt template, product
+    data, user message). anm and erl are (sections, index) pairs from the
+    corpus. Returns (av_text, anm_text, erl_text, usage) where usage lists
+    the estimated tokens per part.
+    """
+    fixed_tokens = estimate_tokens(fixed_text)
+    remaining = max(0, budget - fixed_tokens)
+
+    av_tokens = estimate_tokens(av_text)
+    if av_tokens > remaining:
+        av_text = trim_lines(av_text, remaining)
+        av_tokens = estimate_tokens(av_text)
+    remaining -= av_tokens
+
+    anm_sections, anm_index = anm
+    erl_sections, erl_index = erl
+    erl_need = estimate_tokens(compact('\n'.join(s.text for s in erl_sections))) if erl_sections else 0
+    anm_budget = max(int(remaining * ANM_SHARE), remaining - erl_need)
+    anm_text, anm_tokens = pack_part(anm_sections, keywords, anm_index, anm_budget)
+    erl_text, erl_tokens = pack_part(erl_sections, keywords, erl_index, remaining - anm_tokens)
+
+    usage = {
+        "budget": budget,
+        "fixed": fixed_tokens,
+        "av": av_tokens,
+        "anmerkungen": anm_tokens,
+        "erlaeuterungen": erl_tokens,
+        "total": fixed_tokens + av_tokens + anm_tokens + erl_tokens
+    }
+    return av_text, anm_text, erl_text, usage
@@ -0,0 +1,184 @@
+"""
+Rate-Limiting für Groq – gemeinsamer Token-Bucket für Requests/min und
+Tokens/min mit Prioritäten (interaktiv vor Batch), Abgleich mit den
+x-ratelimit-*-Headern und Retries mit Jitter-Backoff bis zur Deadline.
+"""
+import contextvars, heapq, http.client, itertools, random, re, threading, time
+
+INTERACTIVE, BATCH = 0, 1
+PRIORITY = contextvars.ContextVar("priority", default=INTERACTIVE)
+
+
+class RateLimitTimeout(Exception):
+    """No capacity became available before the request deadline."""
+
+
+class TokenBucket:
+    """Classic token bucket; `rate` units per second, at most `capacity` stored. Not thread-safe."""
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount):
+        """Seconds until `amount` is available (amount is capped at capacity so huge requests can pass)."""
+        missing = min(amount, self.capacity) - self.level
+        return 0.0 if missing <= 0 else missing / self.rate
+
+
+def parse_duration(value):
+    """Groq reset headers: "2m59.56s", "7.66s", "120ms" or plain seconds → seconds."""
+    if value is None:
+        return None
+    value = str(value).strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    total, matched = 0.0, False
+    for number, unit in re.findall(r'([\d.]+)(ms|h|m|s)', value):
+        matched = True
+        total += float(number) * {"ms": 0.001, "s": 1, "m": 60, "h": 3600}[unit]
+    return total if matched else None
+
+
+class RateLimiter:
+    """Shared limiter for requests/min and tokens/min with a priority queue.
+
+    acquire() blocks until both buckets allow the request; among waiters the
+    lowest priority value (INTERACTIVE before BATCH), then arrival order,
+    goes first. observe() feeds back what the upstream reported.
+    """
+
+    def __init__(self, requests_per_minute, tokens_per_minute):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.paused_until = 0.0
+        self._cond = threading.Condition()
+        self._queue = []
+        self._seq = itertools.count()
+        self.stats = {"acquired": 0, "waited_s": 0.0, "timeouts": 0, "throttled": 0}
+
+    def acquire(self, tokens, priority=None, deadline=None):
+        """Reserve one request and `tokens` tokens; raises RateLimitTimeout at the deadline (monotonic)."""
+        priority = PRIORITY.get() if priority is None else priority
+        entry = (priority, next(self._seq))
+        start = time.monotonic()
+        with self._cond:
+            heapq.heappush(self._queue, entry)
+            try:
+                while True:
+                    now = time.monotonic()
+                    self.requests.refill(now)
+                    self.tokens.refill(now)
+                    wait = 0.0
+                    if self._queue[0] != entry:
+                        wait = None   # nicht an der Reihe – bis zum nächsten notify warten
+                    else:
+                        wait = max(self.paused_until - now, self.requests.wait_time(1),
+                                   self.tokens.wait_time(tokens))
+                        if wait <= 0:
+                            self.requests.level -= 1
+                            self.tokens.level -= min(tokens, self.tokens.capacity)
+                            self.stats["acquired"] += 1
+                            self.stats["waited_s"] += now - start
+                            return
+                    if deadline is not None:
+                        remaining = deadline - now
+                        if remaining <= 0 or (wait is not None and wait > remaining):
+                            self.stats["timeouts"] += 1
+                            raise RateLimitTimeout("Groq-Rate-Limit: keine Kapazität vor Ablauf der Deadline")
+                        wait = remaining if wait is None else wait
+                    self._cond.wait(wait)
+            finally:
+                self._queue.remove(entry)
+                heapq.heapify(self._queue)
+                self._cond.notify_all()
+
+    def settle(self, reserved, used):
+        """Give back the difference between reserved and actually used tokens."""
+        if used is None:
+            return
+        with self._cond:
+            self.tokens.level = min(self.tokens.capacity, self.tokens.level + reserved - used)
+            self._cond.notify_all()
+
+    def observe(self, headers, status=None):
+        """Sync with x-ratelimit-* / retry-after response headers (lower-case keys)."""
+        headers = headers or {}
+        now = time.monotonic()
+        with self._cond:
+            remaining_tokens = headers.get("x-ratelimit-remaining-tokens")
+            if remaining_tokens is not None:
+                try:
+                    self.tokens.refill(now)
+                    self.tokens.level = min(self.tokens.level, float(remaining_tokens))
+                except ValueError:
+                    pass
+                if self.tokens.level <= 0:
+                    reset = parse_duration(headers.get("x-ratelimit-reset-tokens"))
+                    if reset:
+                        self.paused_until = max(self.paused_until, now + reset)
+            if headers.get("x-ratelimit-remaining-requests") in ("0", 0):
+                reset = parse_duration(headers.get("x-ratelimit-reset-requests"))
+                if reset:
+                    self.paused_until = max(self.paused_until, now + reset)
+            retry_after = parse_duration(headers.get("retry-after"))
+            if status == 429:
+                self.stats["throttled"] += 1
+                self.paused_until = max(self.paused_until, now + (retry_after or 1.0))
+            self._cond.notify_all()
+
+    def snapshot(self):
+        with self._cond:
+            now = time.monotonic()
+            self.requests.refill(now)
+            self.tokens.refill(now)
+            return dict(self.stats, waiting=len(self._queue), requests_available=round(self.requests.level, 1),
+                        tokens_available=round(self.tokens.level), paused_s=round(max(0.0, self.paused_until - now), 2))
+
+
+# ── Retries ──
+RETRYABLE_STATUS = {408, 409, 425, 429, 500, 502, 503, 504}
+
+
+def is_retryable(error):
+    status = getattr(error, "status", None)
+    if status is not None:
+        return status in RETRYABLE_STATUS
+    return isinstance(error, (OSError, http.client.HTTPException))
+
+
+def backoff_delay(attempt, base=0.5, cap=8.0, retry_after=None):
+    """Full-jitter exponential backoff; an upstream Retry-After is respected as lower bound."""
+    delay = random.uniform(0, min(cap, base * (2 ** attempt)))
+    if retry_after:
+        delay = max(delay, retry_after)
+    return delay
+
+
+def retry_call(fn, deadline, max_attempts=4, base=0.5, cap=8.0):
+    """Call fn(remaining_seconds) until it succeeds, a non-retryable error occurs,
+    max_attempts is reached or the next backoff would cross the deadline (monotonic)."""
+    attempt = 0
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise TimeoutError("Deadline für Groq-Aufruf überschritten")
+        try:
+            return fn(remaining)
+        except Exception as e:
+            attempt += 1
+            if attempt >= max_attempts or not is_retryable(e):
+                raise
+            headers = getattr(e, "headers", None) or {}
+            delay = backoff_delay(attempt - 1, base, cap, parse_duration(headers.get("retry-after")))
+            if time.monotonic() + delay >= deadline:
+                raise
+            time.sleep(delay)
@@ -0,0 +1,112 @@
+"""
+Abschnittssuche – invertierter Index mit BM25-Ranking über die Abschnitte
+eines BAZG-Dokuments, mit deutscher Tokenisierung.
+"""
+import math, re
+from collections import Counter, defaultdict
+
+# Silbentrennung am Zeilenende ("evapo-\n   riert" → "evaporiert")
+HYPHEN_BREAK_RE = re.compile(r'(\w)-[ \t]*\n[ \t]*(?=[a-zäöüß])')
+TOKEN_RE = re.compile(r'[a-z0-9]+')
+UMLAUTS = str.maketrans({'ä': 'ae', 'ö': 'oe', 'ü': 'ue', 'ß': 'ss', 'é': 'e', 'è': 'e', 'à': 'a'})
+
+MIN_TERM_LEN = 4       # wie bisher: kürzere Suchbegriffe werden ignoriert
+MIN_PART_LEN = 5       # minimale Länge eines Kompositum-Teils
+PART_WEIGHT = 0.5      # Gewicht für Treffer über Kompositum-Teile statt exakt
+MAX_EXPANSIONS = 2048  # gecachte Term-Erweiterungen pro Index, danach wird der Cache geleert
+
+
+def normalize(text):
+    """Lowercase, fold umlauts and join words hyphenated across line breaks."""
+    return HYPHEN_BREAK_RE.sub(r'\1', text).lower().translate(UMLAUTS)
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(normalize(text))
+
+
+class SectionIndex:
+    """Inverted index over a list of sections with Okapi BM25 scoring."""
+
+    def __init__(self, sections, k1=1.2, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings = defaultdict(dict)   # term → {section_idx: tf}
+        self.lengths = []
+        for idx, section in enumerate(sections):
+            counts = Counter(tokenize(section.text))
+            self.lengths.append(sum(counts.values()))
+            for term, tf in counts.items():
+                self.postings[term][idx] = tf
+        self.size = len(sections)
+        self.avg_length = (sum(self.lengths) / self.size) if self.size else 0.0
+        self.vocabulary = sorted(self.postings)
+        self._expansions = {}
+
+    @classmethod
+    def from_postings(cls, postings, lengths, k1=1.2, b=0.75):
+        """Index from precomputed postings (term → {section_idx: tf}) and section lengths, e.g. from a bundle."""
+        index = cls([], k1, b)
+        index.postings.update(postings)
+        index.lengths = list(lengths)
+        index.size = len(index.lengths)
+        index.avg_length = (sum(index.lengths) / index.size) if index.size else 0.0
+        index.vocabulary = sorted(index.postings)
+        return index
+
+    def idf(self, term):
+        df = len(self.postings.get(term, ()))
+        return math.log(1 + (self.size - df + 0.5) / (df + 0.5))
+
+    def expand(self, term):
+        """Vocabulary terms matching a query term, with weights.
+
+        German compounds: "saft" also hits "fruchtsaft", and "orangensaft"
+        also hits "saft"; plural/inflected forms are covered the same way.
+        """
+        cached = self._expansions.get(term)
+        if cached is not None:
+            return cached
+        matches = {}
+        if term in self.postings:
+            matches[term] = 1.0
+        for vocab in self.vocabulary:
+            if vocab == term:
+                continue
+            if term in vocab or (len(vocab) >= MIN_PART_LEN and (term.startswith(vocab) or term.endswith(vocab))):
+                matches[vocab] = PART_WEIGHT
+        if len(self._expansions) >= MAX_EXPANSIONS:
+            self._expansions.clear()  # beliebige Suchbegriffe dürfen den Speicher nicht füllen
+        self._expansions[term] = matches
+        return matches
+
+    def score(self, query_terms, boosts=None):
+        """BM25 score per section index for the given (normalized) query terms."""
+        scores = defaultdict(float)
+        weighted = {}
+        for term in query_terms:
+            for vocab, weight in self.expand(term).items():
+                weighted[vocab] = max(weighted.get(vocab, 0.0), weight)
+        for term, boost in (boosts or {}).items():
+            for vocab, weight in self.expand(term).items():
+                weighted[vocab] = max(weighted.get(vocab, 0.0), boost * weight)
+        for term, weight in weighted.items():
+            idf = self.idf(term)
+            for idx, tf in self.postings[term].items():
+                norm = 1 - self.b + self.b * (self.lengths[idx] / self.avg_length) if self.avg_length else 1.0
+                scores[idx] += weight * idf * tf * (self.k1 + 1) / (tf + self.k1 * norm)
+        return scores
+
+    def rank(self, query_terms, boosts=None):
+        """Section indexes with a positive score, best first."""
+        scores = self.score(query_terms, boosts)
+        return sorted((idx for idx, sc in scores.items() if sc > 0), key=lambda idx: (-scores[idx], idx))
+
+
+def query_terms(product_keywords):
+    terms = []
+    for keyword in product_keywords:
+        for token in tokenize(keyword):
+            if len(token) >= MIN_TERM_LEN and token not in terms:
+                terms.append(token)
+    return terms
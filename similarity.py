@@ -0,0 +1,102 @@
+"""
+Ähnlichkeitsindex – Zeichen-n-Gramme früherer Anfragen, um Varianten desselben
+Produkts (andere Packungsgrösse, Schreibweise, Sorte) wiederzuerkennen.
+Inkrementell befüllbar, mit fester Obergrenze (älteste Einträge fallen raus).
+"""
+import math, threading
+from collections import OrderedDict, defaultdict
+
+
+def ngrams(text, n=3):
+    padded = f" {text} "
+    return frozenset(padded[i:i + n] for i in range(max(1, len(padded) - n + 1)))
+
+
+def jaccard(a, b):
+    if not a or not b:
+        return 0.0
+    overlap = len(a & b)
+    return overlap / (len(a) + len(b) - overlap)
+
+
+class SimilarityIndex:
+    """Jaccard similarity over character n-grams with an inverted index.
+
+    search() only looks at entries sharing one of the query's rarest
+    n-grams (prefix filtering: with Jaccard >= t, at least
+    |A| - ceil(t * |A|) + 1 of them must be shared), then verifies the exact
+    score. At most maxsize entries are kept, least recently added first out.
+    """
+
+    def __init__(self, maxsize=20000, n=3):
+        self.maxsize = maxsize
+        self.n = n
+        self._entries = OrderedDict()          # text → (grams, payload)
+        self._postings = defaultdict(set)      # gram → texts
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add(self, text, payload):
+        grams = ngrams(text, self.n)
+        with self._lock:
+            if text in self._entries:
+                self._remove(text)
+            self._entries[text] = (grams, payload)
+            for gram in grams:
+                self._postings[gram].add(text)
+            while len(self._entries) > self.maxsize:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, text):
+        grams, _ = self._entries.pop(text)
+        for gram in grams:
+            texts = self._postings.get(gram)
+            if texts is not None:
+                texts.discard(text)
+                if not texts:
+                    del self._postings[gram]
+
+    def discard(self, text):
+        with self._lock:
+            if text in self._entries:
+                self._remove(text)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._postings.clear()
+
+    def search(self, text, threshold, accept=None):
+        """Best (similarity, text, payload) with similarity >= threshold, or None.
+
+        accept(candidate_text) can veto candidates, e.g. ones with other numbers.
+        """
+        grams = ngrams(text, self.n)
+        with self._lock:
+            ranked = sorted(grams, key=lambda g: len(self._postings.get(g, ())))
+            prefix = len(grams) - math.ceil(threshold * len(grams)) + 1
+            candidates = set()
+            for gram in ranked[:prefix]:
+                candidates.update(self._postings.get(gram, ()))
+            best = None
+            for candidate in candidates:
+                candidate_grams, payload = self._entries[candidate]
+                score = jaccard(grams, candidate_grams)
+                if score < threshold or (best is not None and score <= best[0]):
+                    continue
+                if accept is None or accept(candidate):
+                    best = (score, candidate, payload)
+            if best is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return best
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "maxsize": self.maxsize, "grams": len(self._postings),
+                    "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,129 @@
+"""
+Single-Flight – gleichzeitige identische Klassifizierungen teilen sich eine
+Ausführung: im Prozess über ein Event, zwischen gunicorn-Workern über eine
+Claim-Zeile in der SQLite-Datei des Ergebnis-Caches.
+"""
+import os, socket, sqlite3, threading, time
+from contextlib import contextmanager
+
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """In-process de-duplication: one caller per key runs fn, concurrent callers wait for it."""
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.shared = 0
+
+    def do(self, key, fn, timeout=None):
+        """Returns (result, shared); shared is True when the result came from another caller.
+
+        Waiters give up with TimeoutError after `timeout` seconds; the leader keeps running.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            if not call.done.wait(timeout):
+                raise TimeoutError("Wartezeit auf laufende identische Anfrage überschritten")
+            with self._lock:
+                self.shared += 1
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+        try:
+            call.result = fn()
+            return call.result, False
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+
+class CrossWorkerFlight:
+    """De-duplication across processes sharing one SQLite file.
+
+    The first worker inserts a claim row for the key and runs fn; the
+    others poll `lookup(key)` (the shared result cache) until the result
+    shows up. If the claim disappears without a result (the run failed),
+    the next waiter claims the key and runs fn; after wait_timeout a waiter
+    runs fn unconditionally. Claims older than stale_after seconds (crashed
+    worker) are taken over.
+    """
+
+    def __init__(self, path, lookup, wait_timeout=60.0, poll_interval=0.1, stale_after=120.0):
+        self.path = path
+        self.lookup = lookup
+        self.wait_timeout = wait_timeout
+        self.poll_interval = poll_interval
+        self.stale_after = stale_after
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self.shared = 0
+        with self._connect() as db:
+            db.execute("CREATE TABLE IF NOT EXISTS inflight ("
+                       "key TEXT PRIMARY KEY, owner TEXT NOT NULL, expires_at REAL NOT NULL)")
+
+    @contextmanager
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=5)
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def _claim(self, key):
+        now = time.time()
+        try:
+            with self._connect() as db:
+                db.execute("DELETE FROM inflight WHERE key = ? AND expires_at <= ?", (key, now))
+                db.execute("INSERT INTO inflight (key, owner, expires_at) VALUES (?, ?, ?)",
+                           (key, self.owner, now + self.stale_after))
+            return True
+        except sqlite3.IntegrityError:
+            return False
+        except sqlite3.Error:
+            return True   # DB nicht verfügbar → ohne Koordination weiterarbeiten
+
+    def _release(self, key):
+        try:
+            with self._connect() as db:
+                db.execute("DELETE FROM inflight WHERE key = ? AND owner = ?", (key, self.owner))
+        except sqlite3.Error:
+            pass
+
+    def do(self, key, fn, wait_timeout=None):
+        """Returns (result, shared); shared results come from lookup(key) after another worker finished."""
+        wait_timeout = self.wait_timeout if wait_timeout is None else min(wait_timeout, self.wait_timeout)
+        deadline = time.monotonic() + wait_timeout
+        while True:
+            if self._claim(key):
+                try:
+                    value = self.lookup(key)   # Vorgänger kann gerade fertig geworden sein
+                    if value is not None:
+                        self.shared += 1
+                        return value, True
+                    return fn(), False
+                finally:
+                    self._release(key)
+            value = self.lookup(key)
+            if value is not None:
+                self.shared += 1
+                return value, True
+            if time.monotonic() >= deadline:
+                return fn(), False   # Besitzer hängt – selbst rechnen
+            time.sleep(self.poll_interval)
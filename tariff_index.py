@@ -0,0 +1,145 @@
+"""
+Tarifnummern-Index – alle Positionen (XXXX), Unternummern (XXXX.XX) und
+Schweizer Tarifnummern (XXXX.XXXX), die in den Anmerkungen und Erläuterungen
+vorkommen, mit Kapitel und (falls aufgeführt) Bezeichnung. Prüft und
+normalisiert die Tarifnummer aus der LLM-Antwort lokal.
+"""
+import re
+from collections import defaultdict
+
+# "0201.10: Schlachttierkörper", "0602.2011/2089", "Nr. 0602.2071"
+NUMBER_RE = re.compile(r'(?<![\d.,])(\d{4})\.(\d{4}|\d{2})((?:/\d{4})*)(?![\d,]|\.\d)')
+DEFINITION_RE = re.compile(r'^\s*(\d{4}\.\d{2}(?:\d{2})?):\s*(\S.*)$', re.MULTILINE)
+# Positionsüberschrift in den Erläuterungen: "0201" allein oder "0201 Fleisch von Rindern"
+HEADING_LINE_RE = re.compile(r'^\s*(\d{4})(?:\s*$|\s+([A-ZÄÖÜ«"].*)$)', re.MULTILINE)
+# Verweise im Fliesstext: "Nr. 2207", "Nrn. 2204 bis 2206", "Nummern 0201 bis 0208"
+REFERENCE_RE = re.compile(r'\b(?:Nrn?\.|Nummern?)\s+(\d{4}(?:\s*(?:,|und|oder|bis|-|–)\s*\d{4})*)')
+
+
+def normalize_number(value):
+    """Canonical "XXXX.XXXX" for 8 digits in any common spelling ("2202.99.90", "22029990"), else None."""
+    digits = re.sub(r'[\s.,/-]', '', str(value or ''))
+    if len(digits) != 8 or not digits.isdigit() or not 1 <= int(digits[:2]) <= 97:
+        return None
+    return f"{digits[:4]}.{digits[4:]}"
+
+
+def _valid_heading(heading):
+    return 1 <= int(heading[:2]) <= 97 and heading[2:] != "00"
+
+
+class TariffIndex:
+    """Positions referenced in the corpus, keyed by number.
+
+    The texts do not list every position: only chapters with Erläuterungen
+    have a heading line per position, and only some positions list their
+    subheadings ("0201.10: ..."). validate() therefore rejects a number
+    only where the corpus is complete for it and reports "unverified"
+    otherwise.
+    """
+
+    def __init__(self):
+        self.descriptions = {}                 # "0201" / "0201.10" / "0201.1000" → Bezeichnung ("" = nur erwähnt)
+        self.headings = defaultdict(set)       # chapter → {"0201", ...}
+        self.subheadings = defaultdict(set)    # "0201" → {"0201.10", ...}
+        self.numbers = defaultdict(set)        # "0201.10" → {"0201.1000", ...}
+        self.listed_chapters = set()           # Kapitel mit Überschrift pro Position
+        self.listed_headings = set()           # Positionen mit aufgezählten Unternummern
+
+    @classmethod
+    def from_corpus(cls, corpus):
+        index = cls()
+        for number, chapter in corpus.chapters.items():
+            for kind, text in chapter.texts.items():
+                index.add_text(number, str(text), listing=kind == "erlaeuterungen")
+        return index
+
+    def _add(self, code, description=""):
+        heading = code[:4]
+        if not _valid_heading(heading):
+            return False
+        self.headings[int(heading[:2])].add(heading)
+        self.descriptions.setdefault(heading, "")
+        if len(code) > 4:
+            subheading = code[:7]
+            self.subheadings[heading].add(subheading)
+            self.descriptions.setdefault(subheading, "")
+            if len(code) == 9:
+                self.numbers[subheading].add(code)
+        if description or code not in self.descriptions:
+            self.descriptions[code] = description
+        return True
+
+    def add_text(self, chapter, text, listing=False):
+        """Collect the numbers of one document; listing: it has a heading line per position."""
+        for m in NUMBER_RE.finditer(text):
+            heading, rest = m.group(1), m.group(2)
+            self._add(f"{heading}.{rest}")
+            for extra in filter(None, m.group(3).split("/")):
+                if len(rest) == 4:
+                    self._add(f"{heading}.{extra}")
+        for m in REFERENCE_RE.finditer(text):
+            for heading in re.findall(r'\d{4}', m.group(1)):
+                self._add(heading)
+        for m in DEFINITION_RE.finditer(text):
+            code, description = m.group(1), m.group(2).strip()
+            if self._add(code, description) and listing and len(code) == 7:
+                self.listed_headings.add(code[:4])
+        if listing:
+            for m in HEADING_LINE_RE.finditer(text):
+                heading = m.group(1)
+                if int(heading[:2]) == chapter and self._add(heading, (m.group(2) or "").strip()):
+                    self.listed_chapters.add(chapter)
+
+    def validate(self, value, chapter):
+        """Check an LLM tariff number against the corpus.
+
+        Returns {"status", "tariff_number", "normalized"}: status "ok"
+        (confirmed by the texts), "unverified" (plausible, the texts are not
+        complete here), or "invalid_format", "wrong_chapter",
+        "unknown_heading", "unknown_subheading"; tariff_number is the
+        canonical form or None.
+        """
+        number = normalize_number(value)
+        check = {"status": "ok", "tariff_number": number, "normalized": number is not None and number != value}
+        if number is None:
+            check["status"] = "invalid_format"
+            return check
+        heading, subheading = number[:4], number[:7]
+        try:
+            chapter = int(chapter)
+        except (TypeError, ValueError):
+            chapter = int(number[:2])
+        if int(number[:2]) != chapter:
+            check["status"] = "wrong_chapter"
+        elif heading not in self.headings.get(chapter, ()):
+            check["status"] = "unknown_heading" if chapter in self.listed_chapters else "unverified"
+        elif subheading not in self.subheadings.get(heading, ()):
+            check["status"] = "unknown_subheading" if heading in self.listed_headings else "unverified"
+        elif number not in self.numbers.get(subheading, ()) and heading not in self.listed_headings:
+            check["status"] = "unverified"
+        return check
+
+    def candidates(self, chapter, value=None, limit=40):
+        """[(number, description)] to offer in a correction: the subheadings of the
+        number's heading if the texts list them, otherwise the chapter's headings."""
+        number = normalize_number(value)
+        heading = number[:4] if number else None
+        try:
+            chapter = int(chapter)
+        except (TypeError, ValueError):
+            return []
+        if heading in self.headings.get(chapter, ()) and self.subheadings.get(heading):
+            codes = []
+            for subheading in sorted(self.subheadings[heading]):
+                codes.append(subheading)
+                codes.extend(sorted(self.numbers.get(subheading, ())))
+        else:
+            codes = sorted(self.headings.get(chapter, ()))
+        return [(code, self.descriptions.get(code, "")) for code in codes[:limit]]
+
+    def stats(self):
+        return {"headings": sum(len(h) for h in self.headings.values()),
+                "subheadings": sum(len(s) for s in self.subheadings.values()),
+                "numbers": sum(len(n) for n in self.numbers.values()),
+                "listed_chapters": len(self.listed_chapters), "listed_headings": len(self.listed_headings)}
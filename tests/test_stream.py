@@ -0,0 +1,76 @@
+"""
+Streaming-Pfad gegen den lokalen Upstream-Stub (bench/stub_upstream.py):
+
+    python -m unittest discover -s tests
+"""
+import json, os, sys, threading, unittest
+from unittest import mock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, "bench")]
+
+from stub_upstream import make_server, CLASSIFICATION
+
+
+def start_stub(**options):
+    server = make_server(0, **options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_address[1]}"
+
+
+STUB_URL = start_stub()
+# vor dem Import von app setzen: die Konfiguration wird beim Import gelesen
+os.environ.update(GROQ_API_KEY="test", GROQ_URL=f"{STUB_URL}/openai/v1/chat/completions", OFF_BASE_URL=STUB_URL,
+                  RESULT_CACHE_PATH="", OFF_SNAPSHOT_PATH="", CORPUS_BUNDLE_PATH="")
+
+import app
+
+
+def parse_sse(body):
+    """[(event, data)] of an SSE body; comments (keep-alive) are skipped."""
+    events = []
+    for frame in body.split("\n\n"):
+        lines = [line for line in frame.split("\n") if line and not line.startswith(":")]
+        if lines:
+            fields = dict(line.split(": ", 1) for line in lines)
+            events.append((fields["event"], json.loads(fields["data"])))
+    return events
+
+
+class StreamTest(unittest.TestCase):
+    def stream(self, product):
+        response = app.app.test_client().post("/classify/stream", json={"product": product})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.mimetype.startswith("text/event-stream"))
+        return parse_sse(response.get_data(as_text=True))
+
+    def test_event_order(self):
+        events = self.stream("Rivella Rot 500 ml")
+        names = [name for name, _ in events]
+        self.assertEqual(names[:3], ["product", "chapter", "docs"])
+        self.assertEqual(names[-1], "result")
+        tokens = names[3:-1]
+        self.assertTrue(tokens)
+        self.assertEqual(set(tokens), {"token"})
+
+    def test_result_parses(self):
+        events = self.stream("Eistee Pfirsich")
+        streamed = "".join(data["text"] for name, data in events if name == "token")
+        self.assertEqual(json.loads(streamed)["tariff_number"], CLASSIFICATION["tariff_number"])
+        result = events[-1][1]
+        self.assertNotIn("error", result)
+        self.assertEqual(result["tariff_number"], CLASSIFICATION["tariff_number"])
+        self.assertEqual(result["chapter"], 22)
+        self.assertIn("_tariff_check", result)
+
+    def test_connection_close(self):
+        # SSE-Body ohne Chunked-Encoding, der mit dem Verbindungsabbau endet
+        url = start_stub(stream_close=True)
+        with mock.patch.object(app, "GROQ_URL", f"{url}/openai/v1/chat/completions"):
+            events = self.stream("Zitronenlimonade")
+        self.assertEqual([name for name, _ in events][-1], "result")
+        self.assertEqual(events[-1][1]["tariff_number"], CLASSIFICATION["tariff_number"])
+
+
+if __name__ == "__main__":
+    unittest.main()